@@ -1,8 +1,9 @@
 from django.contrib import admin
-from .models import CustomUser, Password, ApiUser, APIKey, QuickTip
+from .models import CustomUser, Password, ApiUser, APIKey, QuickTip, OutboundEmail
 
 admin.site.register(CustomUser)
 admin.site.register(Password)
 admin.site.register(ApiUser)
 admin.site.register(APIKey)
-admin.site.register(QuickTip)
\ No newline at end of file
+admin.site.register(QuickTip)
+admin.site.register(OutboundEmail)
\ No newline at end of file
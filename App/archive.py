@@ -0,0 +1,83 @@
+import base64
+import json
+import os
+from asgiref.sync import sync_to_async
+from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+from .models import Password
+from .crypto import encrypt_batch, decrypt_batch, chunked
+
+#pylint: disable=no-member
+ARCHIVE_FORMAT = 'password-manager-archive'
+ARCHIVE_VERSION = 1
+KDF_ITERATIONS = 480000
+EXPORT_CHUNK_SIZE = 500
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def archive_fernet(passphrase, salt, iterations=KDF_ITERATIONS):
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=iterations)
+    return Fernet(base64.urlsafe_b64encode(kdf.derive(passphrase.encode())))
+
+
+def export_archive(owner, passphrase):
+    """Yield an owner's vault as newline-delimited JSON, one encrypted entry per line.
+    
+    Rows are read through a chunked iterator (a server-side cursor on Postgres)
+    and each chunk is yielded as one string, so memory use does not grow with
+    the size of the vault.
+    """
+    salt = os.urandom(16)
+    fernet = archive_fernet(passphrase, salt)
+    header = {
+        'format': ARCHIVE_FORMAT,
+        'version': ARCHIVE_VERSION,
+        'kdf': 'pbkdf2-sha256',
+        'iterations': KDF_ITERATIONS,
+        'salt': base64.b64encode(salt).decode(),
+    }
+    yield json.dumps(header) + '\n'
+    
+    queryset = Password.objects.filter(owner=owner).order_by('id')
+    for chunk in chunked(queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE), EXPORT_CHUNK_SIZE):
+        entries = Password.decrypt_many(chunk)
+        yield ''.join(token + '\n' for token in encrypt_batch([(fernet, json.dumps(entry)) for entry in entries]))
+
+
+async def aexport_archive(owner, passphrase):
+    """export_archive for ASGI servers, which buffer synchronous iterators in full.
+    
+    Each chunk's database and crypto work runs through sync_to_async, so the
+    export still streams one chunk at a time.
+    """
+    chunks = export_archive(owner, passphrase)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
+
+
+def read_archive(archive, passphrase):
+    """Decrypt an exported archive back into a list of plaintext entries."""
+    lines = [line for line in archive.splitlines() if line.strip()]
+    if not lines:
+        raise ArchiveError('The archive is empty.')
+    
+    try:
+        header = json.loads(lines[0])
+        if header.get('format') != ARCHIVE_FORMAT or header.get('version') != ARCHIVE_VERSION:
+            raise ArchiveError('Unsupported archive format.')
+        iterations = header['iterations']
+        # The header is user input; never let it set an arbitrary KDF cost.
+        if type(iterations) is not int or not 0 < iterations <= KDF_ITERATIONS:
+            raise ArchiveError('Unsupported archive key derivation settings.')
+        fernet = archive_fernet(passphrase, base64.b64decode(header['salt']), iterations)
+        return [json.loads(entry) for entry in decrypt_batch([(fernet, line) for line in lines[1:]])]
+    except ArchiveError:
+        raise
+    except Exception:
+        raise ArchiveError('The archive could not be decrypted.')
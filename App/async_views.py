@@ -0,0 +1,171 @@
+import json
+import math
+import uuid
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.tokens import AccessToken
+
+from django.conf import settings
+
+from .models import CustomUser, QuickTip, APIKey
+from .serializers import UserSerializer, LoginSerializer, ResendCodeSerializer
+from .permissions import aget_api_user
+from .throttling import consume, request_identities
+from .hashing import averify_credentials, arecord_login, HashingPoolSaturated
+from .views import send_verification_code, send_reset_code
+
+#pylint: disable=no-member
+QUICK_TIPS_CACHE_KEY = 'quick-tips'
+
+
+def api_key_required(view):
+    """Async version of APIKeyPermission for plain Django views."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get('X-API-Key') or request.headers.get('Authorization')
+        if not key:
+            return JsonResponse({'detail': 'API key is required'}, status=status.HTTP_401_UNAUTHORIZED)
+        try:
+            request.api_user = await aget_api_user(str(uuid.UUID(key)))
+        except (ValueError, APIKey.DoesNotExist):
+            return JsonResponse({'detail': 'Invalid API key'}, status=status.HTTP_401_UNAUTHORIZED)
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def throttled(scope):
+    """Async version of TokenBucketThrottle for plain Django views."""
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            account = _payload(request).get('email') or kwargs.get('user_id')
+            identities = request_identities(request, account, BaseThrottle().get_ident(request))
+            if settings.THROTTLE_CACHE_ALIAS:
+                wait = await sync_to_async(consume)(scope, identities)
+            else:
+                wait = consume(scope, identities)
+            if wait:
+                response = JsonResponse({'detail': 'Request was throttled.'}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            return await view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _payload(request):
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return request.POST.dict()
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+async def register(request):
+    data = _payload(request)
+    email = data.get('email', None)
+    if email and await CustomUser.objects.filter(email=email).aexists():
+        return JsonResponse({'detail': 'This email is already in use.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = UserSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    user = await sync_to_async(serializer.save)()
+    
+    await sync_to_async(send_verification_code)(request=request, user=user)
+    
+    return JsonResponse(serializer.data, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+@throttled('login')
+async def login(request):
+    serializer = LoginSerializer(data=_payload(request))
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    email = serializer.validated_data['email']
+    password = serializer.validated_data['password']
+    
+    try:
+        user = await averify_credentials(email, password)
+    except HashingPoolSaturated:
+        response = JsonResponse(
+            {'error': 'Too many login attempts in progress, please retry shortly.'},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        response['Retry-After'] = str(settings.LOGIN_RETRY_AFTER)
+        return response
+    
+    if user is None:
+        return JsonResponse({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
+    if not user.is_verified:
+        return JsonResponse({'error': 'Your account needs to be verified to proceed.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    await arecord_login(request, user)
+    return JsonResponse({'token': str(AccessToken.for_user(user)), 'user': str(user.id)}, status=status.HTTP_200_OK)
+
+
+async def _resend(request, send_code):
+    email = _payload(request).get('email', None)
+    if not email:
+        return JsonResponse({'detail': 'Email is required.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    existing_user = await CustomUser.objects.filter(email=email).afirst()
+    if not existing_user:
+        return JsonResponse({'detail': 'User with this email does not exist.'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    await sync_to_async(send_code)(request=request, user=existing_user)
+    return JsonResponse(ResendCodeSerializer(existing_user).data, status=status.HTTP_201_CREATED)
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+@throttled('send-code')
+async def resend_verification_code(request):
+    return await _resend(request, send_verification_code)
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+@throttled('send-code')
+async def resend_reset_code(request):
+    return await _resend(request, send_reset_code)
+
+
+@csrf_exempt
+@require_POST
+@api_key_required
+@throttled('send-code')
+async def reset_password(request):
+    email = _payload(request).get('email')
+    
+    try:
+        user = await CustomUser.objects.aget(email=email)
+    except CustomUser.DoesNotExist:
+        return JsonResponse({"error": "A user with this email does not exist."}, status=status.HTTP_404_NOT_FOUND)
+    
+    await sync_to_async(send_reset_code)(request=request, user=user)
+    
+    return JsonResponse({"message": "A reset code has been sent to your email."}, status=status.HTTP_200_OK)
+
+
+@require_GET
+@api_key_required
+async def quick_tips(request):
+    tips = await cache.aget(QUICK_TIPS_CACHE_KEY)
+    if tips is None:
+        tips = [tip async for tip in QuickTip.objects.values()]
+        await cache.aset(QUICK_TIPS_CACHE_KEY, tips, settings.QUICK_TIPS_CACHE_TTL)
+    return JsonResponse(tips, safe=False, status=status.HTTP_200_OK)
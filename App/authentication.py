@@ -0,0 +1,61 @@
+import copy
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from django.utils.translation import gettext_lazy as _
+
+from .caching import TTLCache, is_shared
+from .routers import use_primary
+
+#pylint: disable=no-member
+_users = TTLCache(maxsize=settings.AUTH_USER_CACHE_SIZE, ttl=settings.AUTH_USER_CACHE_TTL)
+
+
+def _stamp_key(user_id):
+    return f'user-version:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    """Make every process reload the user on its next request, once the current transaction commits."""
+    def bump():
+        try:
+            cache.incr(_stamp_key(user_id))
+        except ValueError:
+            cache.set(_stamp_key(user_id), 1, None)
+        _users.delete(str(user_id))
+    transaction.on_commit(bump)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that keeps token users in memory for AUTH_USER_CACHE_TTL seconds.
+
+    A cached user is only reused while its version stamp in the shared cache
+    is unchanged, so saving or deleting a user takes effect straight away.
+    Without a shared default cache other workers would never see the stamp
+    move, so users are then loaded on every request.
+    """
+    def get_user(self, validated_token):
+        if not is_shared(cache):
+            with use_primary():
+                return super().get_user(validated_token)
+        try:
+            user_id = str(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            return super().get_user(validated_token)
+
+        stamp = cache.get(_stamp_key(user_id), 0)
+        cached = _users.get(user_id)
+        if cached is not None and cached[0] == stamp:
+            user = cached[1]
+            if not user.is_active:
+                raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+            return copy.copy(user)
+
+        # A replica may not have the change that bumped the stamp yet.
+        with use_primary():
+            user = super().get_user(validated_token)
+        _users.set(user_id, (stamp, user))
+        return copy.copy(user)
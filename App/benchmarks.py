@@ -0,0 +1,278 @@
+import json
+import os
+import platform
+import time
+import tracemalloc
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import CustomUser, Password, PasswordSearchToken, ApiUser, APIKey
+from .search import build_search_tokens
+from .serializers import PasswordSerializer, PasswordRowSerializer
+from .renderers import VaultJSONRenderer
+from .crypto import encrypt_batch, decrypt_batch
+
+#pylint: disable=no-member
+BENCHMARK_PASSWORD = 'bench-password-123'
+SEED_BATCH_SIZE = 1000
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+class Fixture:
+    """Synthetic API user, account and vault that the scenarios run against."""
+    def __init__(self, entries):
+        api_user = ApiUser.objects.create(email='bench-api@example.com', first_name='Bench', last_name='Mark')
+        self.api_key = str(APIKey.objects.create(owner=api_user).api_key)
+        
+        self.user = CustomUser.objects.create_user(email='bench@example.com', password=BENCHMARK_PASSWORD)
+        self.user.is_verified = True
+        self.user.save()
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+        
+        self.password_ids = seed_vault(self.user, entries)
+        self.client = Client(HTTP_X_API_KEY=self.api_key, HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.api_client = Client(HTTP_AUTHORIZATION=self.api_key)
+
+
+def seed_vault(user, entries):
+    ids = []
+    for start in range(0, entries, SEED_BATCH_SIZE):
+        values_list = [
+            {
+                'application_name': f'Application {i}',
+                'site_url': f'https://site{i}.example.com/login',
+                'email_used': f'user{i}@example.com',
+                'username_used': f'user{i}',
+                'password': f'secret-{i}',
+            }
+            for i in range(start, min(start + SEED_BATCH_SIZE, entries))
+        ]
+        passwords = [Password(owner=user) for _ in values_list]
+        Password.set_encrypted_many(passwords, values_list)
+        search_tokens = []
+        for instance, values in zip(passwords, values_list):
+            search_tokens.extend(build_search_tokens(instance, values))
+        Password.objects.bulk_create(passwords)
+        PasswordSearchToken.objects.bulk_create(search_tokens)
+        ids.extend(instance.id for instance in passwords)
+    return ids
+
+
+@scenario('login')
+def login_request(fixture, i):
+    return fixture.api_client.post(
+        '/api/v1/accounts/login/',
+        {'email': fixture.user.email, 'password': BENCHMARK_PASSWORD},
+        content_type='application/json',
+    )
+
+
+@scenario('login-stateless')
+def stateless_login_request(fixture, i):
+    return fixture.api_client.post(
+        '/api/v1/accounts/login/',
+        {'email': fixture.user.email, 'password': BENCHMARK_PASSWORD},
+        content_type='application/json',
+        headers={'X-Stateless-Login': 'true'},
+    )
+
+
+@scenario('list')
+def list_request(fixture, i):
+    return fixture.client.get('/api/v1/dashboard/passwords/')
+
+
+@scenario('list-sparse')
+def sparse_list_request(fixture, i):
+    return fixture.client.get('/api/v1/dashboard/passwords/', {'fields': 'id,application_name'})
+
+
+@scenario('retrieve')
+def retrieve_request(fixture, i):
+    password_id = fixture.password_ids[i % len(fixture.password_ids)]
+    return fixture.client.get(f'/api/v1/dashboard/passwords/{password_id}/')
+
+
+@scenario('create')
+def create_request(fixture, i):
+    return fixture.client.post(
+        '/api/v1/dashboard/passwords/',
+        {
+            'application_name': f'Created {i}',
+            'site_url': f'https://created{i}.example.com',
+            'email_used': f'created{i}@example.com',
+            'username_used': f'created{i}',
+            'password': f'created-secret-{i}',
+        },
+        content_type='application/json',
+    )
+
+
+@scenario('search')
+def search_request(fixture, i):
+    return fixture.client.get('/api/v1/dashboard/passwords/', {'search': f'application {i}'})
+
+
+@scenario('connect')
+def connect_request(fixture, i):
+    """A small endpoint on a fresh connection, to compare per-request connects with pooling."""
+    connection.close()
+    return fixture.api_client.get('/api/v1/dashboard/quick-tips/')
+
+
+@scenario('verification')
+def verification_request(fixture, i):
+    return fixture.api_client.post(
+        '/api/v1/resend-verification-code/', {'email': fixture.user.email}, content_type='application/json'
+    )
+
+
+@scenario('reset')
+def reset_request(fixture, i):
+    return fixture.api_client.post(
+        '/api/v1/accounts/reset-password/', {'email': fixture.user.email}, content_type='application/json'
+    )
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def measure(func, fixture, iterations, warmup=2):
+    for i in range(warmup):
+        func(fixture, i)
+    
+    timings = []
+    queries = []
+    statuses = set()
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = func(fixture, i)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries.append(len(captured))
+        statuses.add(response.status_code)
+    
+    tracemalloc.start()
+    func(fixture, iterations)
+    allocated, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3),
+        # Requests run one at a time, so this is also the rate per core.
+        'requests_per_second': round(len(timings) * 1000 / sum(timings), 1),
+        'queries_per_request': round(sum(queries) / len(queries), 2),
+        'allocated_kib': round(allocated / 1024, 1),
+        'peak_kib': round(peak / 1024, 1),
+        'status_codes': sorted(statuses),
+    }
+
+
+def run(entries, iterations, scenarios=None, serialization=False):
+    fixture = Fixture(entries)
+    results = {}
+    for name in scenarios or SCENARIOS:
+        results[name] = measure(SCENARIOS[name], fixture, iterations)
+    report = {
+        'meta': {
+            'entries': entries,
+            'iterations': iterations,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'timestamp': timezone.now().isoformat(),
+        },
+        'scenarios': results,
+    }
+    if serialization:
+        report['serialization'] = compare_serializers(fixture.user)
+    return report
+
+
+def crypto_crossover(sizes=(16, 64, 256, 1024, 4096), repeat=5):
+    """Time inline against pooled batch decryption at each batch size.
+    
+    The smallest size where pooled wins is a good CRYPTO_PARALLEL_THRESHOLD
+    for this machine.
+    """
+    fernet = Fernet(Fernet.generate_key())
+    results = []
+    for size in sizes:
+        pairs = [(fernet, token) for token in encrypt_batch([(fernet, f'secret-{i}') for i in range(size)], parallel=False)]
+        row = {'batch_size': size}
+        for mode, parallel in (('inline', False), ('pooled', True)):
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                decrypt_batch(pairs, parallel=parallel)
+                timings.append((time.perf_counter() - started) * 1000)
+            row[f'{mode}_ms'] = round(min(timings), 3)
+        row['speedup'] = round(row['inline_ms'] / row['pooled_ms'], 2) if row['pooled_ms'] else None
+        results.append(row)
+    
+    crossover = next((row['batch_size'] for row in results if row['speedup'] and row['speedup'] > 1), None)
+    return {
+        'workers': settings.CRYPTO_POOL_WORKERS,
+        'threshold': settings.CRYPTO_PARALLEL_THRESHOLD,
+        'crossover_batch_size': crossover,
+        'sizes': results,
+    }
+
+
+def compare_serializers(user, repeat=3):
+    """Time the DRF serializer and renderer against the list fast path over a whole vault."""
+    entries = list(Password.objects.filter(owner=user))
+    decrypted = Password.decrypt_many(entries, ['application_name'])
+    for instance, values in zip(entries, decrypted):
+        instance.application_name = values['application_name']
+    
+    def drf():
+        return JSONRenderer().render(PasswordSerializer(entries, many=True).data)
+    
+    def fast():
+        return VaultJSONRenderer().render(PasswordRowSerializer().many(entries, decrypted))
+    
+    results = {'entries': len(entries)}
+    for name, func in (('drf', drf), ('fast', fast)):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[f'{name}_ms'] = round(min(timings), 3)
+    results['speedup'] = round(results['drf_ms'] / results['fast_ms'], 2)
+    return results
+
+
+def compare(report, baseline, max_regression):
+    """Return the scenarios whose p95 grew by more than max_regression (a fraction) over the baseline."""
+    regressions = {}
+    for name, result in report['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous and result['p95_ms'] > previous['p95_ms'] * (1 + max_regression):
+            regressions[name] = {'baseline_p95_ms': previous['p95_ms'], 'p95_ms': result['p95_ms']}
+    return regressions
+
+
+def dumps(report):
+    return json.dumps(report, indent=2)
@@ -0,0 +1,133 @@
+"""
+Offline breached-password checks against a memory-mapped, sharded Bloom filter.
+
+The filter file holds a header, a table of (offset, size in bits) for each
+shard and then the shards themselves. A password's shard is picked by the
+leading bits of its SHA-1, and its k bit positions come from the rest of the
+digest, so a lookup touches a single shard and at most k pages of the file.
+Build one from a corpus with manage.py build_breach_filter.
+"""
+import hashlib
+import logging
+import math
+import mmap
+import struct
+import threading
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext as _
+
+#pylint: disable=no-member
+logger = logging.getLogger(__name__)
+
+MAGIC = b'PMBLOOM1'
+HEADER = struct.Struct('<8sBBI')
+SHARD = struct.Struct('<QQ')
+
+
+def shard_of(digest, shard_bits):
+    return int.from_bytes(digest[:4], 'big') >> (32 - shard_bits) if shard_bits else 0
+
+
+def bit_positions(digest, size, hash_count):
+    # Double hashing over the bytes the shard prefix did not use.
+    first = int.from_bytes(digest[4:12], 'big')
+    step = int.from_bytes(digest[12:20], 'big') | 1
+    return [(first + i * step) % size for i in range(hash_count)]
+
+
+class BreachFilter:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.shard_bits, self.hash_count, shard_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a breach filter.')
+        self.shards = [SHARD.unpack_from(self.map, HEADER.size + i * SHARD.size) for i in range(shard_count)]
+
+    def __contains__(self, password):
+        return self.contains_digest(hashlib.sha1(password.encode()).digest())
+
+    def contains_digest(self, digest):
+        offset, size = self.shards[shard_of(digest, self.shard_bits)]
+        if not size:
+            return False
+        for position in bit_positions(digest, size, self.hash_count):
+            if not self.map[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def close(self):
+        self.map.close()
+
+
+def build_filter(path, read_digests, false_positive_rate=0.001, shard_bits=8):
+    """Write a filter holding every SHA-1 digest yielded by read_digests().
+
+    The corpus is read twice, once to size the shards and once to set their
+    bits, so read_digests must return a fresh iterator on each call. Bits are
+    set through a writable mapping, so the filter never has to fit in memory.
+    """
+    counts = [0] * (1 << shard_bits)
+    for digest in read_digests():
+        counts[shard_of(digest, shard_bits)] += 1
+    
+    hash_count = max(1, round(-math.log2(false_positive_rate)))
+    sizes = [math.ceil(-count * math.log(false_positive_rate) / math.log(2) ** 2) if count else 0 for count in counts]
+    offsets = []
+    offset = HEADER.size + len(sizes) * SHARD.size
+    for size in sizes:
+        offsets.append(offset)
+        offset += (size + 7) // 8
+    
+    with open(path, 'w+b') as f:
+        f.write(HEADER.pack(MAGIC, shard_bits, hash_count, len(sizes)))
+        for shard_offset, size in zip(offsets, sizes):
+            f.write(SHARD.pack(shard_offset, size))
+        f.truncate(offset)
+        with mmap.mmap(f.fileno(), 0) as bits:
+            for digest in read_digests():
+                shard = shard_of(digest, shard_bits)
+                for position in bit_positions(digest, sizes[shard], hash_count):
+                    bits[offsets[shard] + (position >> 3)] |= 1 << (position & 7)
+            bits.flush()
+    return sum(counts)
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def get_breach_filter():
+    """The filter at BREACH_FILTER_PATH, or None when no filter is configured."""
+    global _filter
+    path = settings.BREACH_FILTER_PATH
+    if not path:
+        return None
+    if _filter is None:
+        with _filter_lock:
+            if _filter is None:
+                try:
+                    _filter = BreachFilter(path)
+                except (OSError, ValueError) as e:
+                    logger.warning('Breached password checks are disabled: %s', e)
+                    _filter = False
+    return _filter or None
+
+
+def is_breached(password):
+    breach_filter = get_breach_filter()
+    return bool(password) and breach_filter is not None and password in breach_filter
+
+
+class BreachedPasswordValidator:
+    """Reject passwords found in the offline breach filter."""
+    def validate(self, password, user=None):
+        if is_breached(password):
+            raise ValidationError(
+                _('This password has appeared in a data breach. Please choose a different one.'),
+                code='password_breached',
+            )
+
+    def get_help_text(self):
+        return _('Your password must not appear in a known data breach.')
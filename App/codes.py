@@ -0,0 +1,98 @@
+import secrets
+import string
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+from .models import VerificationCode, PasswordResetCode
+
+#pylint: disable=no-member
+VERIFICATION = 'verification'
+RESET = 'reset'
+
+
+def generate_code():
+    return ''.join(secrets.choice(string.digits) for _ in range(6))
+
+
+class CodeStore(ABC):
+    """Issues and checks the 6-digit codes sent for account verification and password resets.
+    
+    Codes expire after CODE_TTL seconds, and a code is dropped once
+    CODE_MAX_ATTEMPTS checks have been made against it.
+    """
+    def __init__(self):
+        self.ttl = settings.CODE_TTL
+        self.max_attempts = settings.CODE_MAX_ATTEMPTS
+
+    @abstractmethod
+    def issue(self, purpose, user):
+        """Replace any outstanding code for the user and return the new one."""
+
+    @abstractmethod
+    def verify(self, purpose, user, code):
+        """Consume the user's code if it matches. Only one caller can consume a given code."""
+
+
+class CacheCodeStore(CodeStore):
+    """Codes live in the Django cache and expire with the cache TTL."""
+    def __init__(self):
+        super().__init__()
+        self.cache = caches[settings.CODE_STORE_CACHE_ALIAS]
+
+    def _keys(self, purpose, user):
+        return f'code:{purpose}:{user.pk}', f'code-attempts:{purpose}:{user.pk}'
+
+    def issue(self, purpose, user):
+        code_key, attempts_key = self._keys(purpose, user)
+        code = generate_code()
+        self.cache.set(code_key, code, self.ttl)
+        self.cache.delete(attempts_key)
+        return code
+
+    def verify(self, purpose, user, code):
+        code_key, attempts_key = self._keys(purpose, user)
+        self.cache.add(attempts_key, 0, self.ttl)
+        try:
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            attempts = 1
+        if attempts > self.max_attempts:
+            self.cache.delete(code_key)
+            return False
+        
+        stored = self.cache.get(code_key)
+        if stored is None or not constant_time_compare(stored, str(code)):
+            return False
+        return bool(self.cache.delete(code_key))
+
+
+class DatabaseCodeStore(CodeStore):
+    """Codes are rows in VerificationCode / PasswordResetCode."""
+    models = {
+        VERIFICATION: VerificationCode,
+        RESET: PasswordResetCode,
+    }
+
+    def issue(self, purpose, user):
+        model = self.models[purpose]
+        model.objects.filter(user=user).delete()
+        return model.create(user).code
+
+    def verify(self, purpose, user, code):
+        valid_after = timezone.now() - timezone.timedelta(seconds=self.ttl)
+        codes = self.models[purpose].objects.filter(user=user, created_at__gte=valid_after)
+        codes.update(attempts=F('attempts') + 1)
+        codes.filter(attempts__gt=self.max_attempts).delete()
+        deleted, _ = codes.filter(code=str(code)).delete()
+        return deleted > 0
+
+
+@lru_cache(maxsize=None)
+def get_code_store():
+    return import_string(settings.CODE_STORE)()
@@ -0,0 +1,231 @@
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from cryptography.fernet import Fernet, MultiFernet
+
+from .caching import TTLCache
+from .routers import use_primary
+from . import metrics
+
+#pylint: disable=no-member
+_data_key_cache = TTLCache(maxsize=settings.DATA_KEY_CACHE_SIZE, ttl=settings.DATA_KEY_CACHE_TTL)
+# The generation last read from the shared cache, and when it was read.
+_key_generation = [0, float('-inf')]
+KEY_GENERATION_CACHE_KEY = 'data-key-generation'
+_crypto_pool = None
+_crypto_pool_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1024)
+def _cached_fernet(key):
+    return Fernet(key)
+
+
+def get_fernet(key):
+    """Return a shared Fernet instance for the given key."""
+    return _cached_fernet(bytes(key))
+
+
+@lru_cache(maxsize=1)
+def master_fernet():
+    """The first master key wraps new data keys; every listed key can unwrap."""
+    return MultiFernet([Fernet(key) for key in settings.VAULT_MASTER_KEYS])
+
+
+def wrap_key(data_key):
+    return master_fernet().encrypt(data_key)
+
+
+def unwrap_key(wrapped_key):
+    return master_fernet().decrypt(bytes(wrapped_key))
+
+
+def get_user_fernet(user_id):
+    """Return the cipher for a user's data key, creating the key on first use.
+    
+    While the user's key is being rotated the retired key is kept as a
+    fallback, so rows not yet re-encrypted still decrypt.
+    """
+    generation = data_key_generation()
+    cached = _data_key_cache.get(user_id)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+    
+    # A lagging replica could still hold the key from before a rewrap, and
+    # it would then be cached for DATA_KEY_CACHE_TTL.
+    users = get_user_model().objects
+    with use_primary():
+        keys = users.filter(pk=user_id).values_list('wrapped_key', 'retired_key').first()
+        if not keys or not keys[0]:
+            users.filter(pk=user_id, wrapped_key__isnull=True).update(wrapped_key=wrap_key(Fernet.generate_key()))
+            keys = users.filter(pk=user_id).values_list('wrapped_key', 'retired_key').get()
+    
+    wrapped_key, retired_key = keys
+    with metrics.timed('unwrap'):
+        fernet = get_fernet(unwrap_key(wrapped_key))
+        if retired_key:
+            fernet = MultiFernet([fernet, get_fernet(unwrap_key(retired_key))])
+    _data_key_cache.set(user_id, (generation, fernet))
+    return fernet
+
+
+def data_key_generation():
+    """The shared data key generation, re-read at most every DATA_KEY_GENERATION_CHECK_INTERVAL seconds."""
+    generation, checked_at = _key_generation
+    now = time.monotonic()
+    if now - checked_at >= settings.DATA_KEY_GENERATION_CHECK_INTERVAL:
+        generation = cache.get(KEY_GENERATION_CACHE_KEY, 0)
+        _key_generation[:] = [generation, now]
+    return generation
+
+
+def forget_data_keys():
+    """Make every process sharing the default cache unwrap data keys again."""
+    try:
+        cache.incr(KEY_GENERATION_CACHE_KEY)
+    except ValueError:
+        cache.set(KEY_GENERATION_CACHE_KEY, 1, None)
+    _data_key_cache.clear()
+    _key_generation[1] = float('-inf')
+
+
+def decrypt_fields(instance, fields, fernet):
+    """Decrypt the given fields of a Password instance into a dict."""
+    started = time.perf_counter()
+    decrypted_data = {}
+    for field in fields:
+        value = getattr(instance, field)
+        if isinstance(value, str):
+            decrypted_data[field] = fernet.decrypt(value.encode()).decode()
+    metrics.record('decrypt', (time.perf_counter() - started) * 1000, len(decrypted_data))
+    return decrypted_data
+
+
+def keyed_digest(*parts):
+    """HMAC the given parts with the blind index key."""
+    message = '\x1f'.join(str(part) for part in parts).encode()
+    return hmac.new(settings.BLIND_INDEX_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+
+def encrypt_fields(values, fields, fernet):
+    """Encrypt the given fields of a plaintext dict."""
+    started = time.perf_counter()
+    encrypted_data = {}
+    for field in fields:
+        value = values.get(field)
+        if isinstance(value, str):
+            encrypted_data[field] = fernet.encrypt(value.encode()).decode()
+    metrics.record('encrypt', (time.perf_counter() - started) * 1000, len(encrypted_data))
+    return encrypted_data
+
+
+def _get_crypto_pool():
+    global _crypto_pool
+    if _crypto_pool is None:
+        with _crypto_pool_lock:
+            if _crypto_pool is None:
+                _crypto_pool = ThreadPoolExecutor(max_workers=settings.CRYPTO_POOL_WORKERS, thread_name_prefix='crypto')
+    return _crypto_pool
+
+
+def _run_batch(operation, pairs, parallel=None):
+    """Apply operation to every (fernet, token) pair, in order.
+    
+    Batches below CRYPTO_PARALLEL_THRESHOLD run inline; larger ones are split
+    into one chunk per worker, since the cipher work releases the GIL.
+    """
+    if parallel is None:
+        parallel = settings.CRYPTO_POOL_WORKERS > 1 and len(pairs) >= settings.CRYPTO_PARALLEL_THRESHOLD
+    if not parallel:
+        return [operation(fernet, value) for fernet, value in pairs]
+    
+    chunk_size = -(-len(pairs) // settings.CRYPTO_POOL_WORKERS)
+    chunks = [pairs[start:start + chunk_size] for start in range(0, len(pairs), chunk_size)]
+    results = []
+    for chunk in _get_crypto_pool().map(lambda chunk: [operation(fernet, value) for fernet, value in chunk], chunks):
+        results.extend(chunk)
+    return results
+
+
+def _encrypt(fernet, value):
+    return fernet.encrypt(value.encode()).decode()
+
+
+def _decrypt(fernet, value):
+    return fernet.decrypt(value.encode()).decode()
+
+
+def _rotate(fernet, value):
+    return fernet.rotate(value.encode()).decode()
+
+
+def chunked(iterable, size):
+    """Yield lists of up to size items, e.g. to feed a row iterator to the batch helpers."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def encrypt_batch(pairs, parallel=None):
+    """Encrypt a list of (fernet, plaintext) pairs into a list of tokens."""
+    started = time.perf_counter()
+    tokens = _run_batch(_encrypt, pairs, parallel)
+    metrics.record('encrypt', (time.perf_counter() - started) * 1000, len(tokens))
+    return tokens
+
+
+def decrypt_batch(pairs, parallel=None):
+    """Decrypt a list of (fernet, token) pairs into a list of plaintexts."""
+    started = time.perf_counter()
+    plaintexts = _run_batch(_decrypt, pairs, parallel)
+    metrics.record('decrypt', (time.perf_counter() - started) * 1000, len(plaintexts))
+    return plaintexts
+
+
+def rotate_batch(pairs, parallel=None):
+    """Re-encrypt a list of (multi_fernet, token) pairs under the primary key."""
+    started = time.perf_counter()
+    tokens = _run_batch(_rotate, pairs, parallel)
+    metrics.record('rotate', (time.perf_counter() - started) * 1000, len(tokens))
+    return tokens
+
+
+def decrypt_rows(instances, fields):
+    """Decrypt the given fields of many Password instances, one dict per instance."""
+    pairs, slots = [], []
+    for position, instance in enumerate(instances):
+        fernet = instance.get_fernet()
+        for field in fields:
+            value = getattr(instance, field)
+            if isinstance(value, str):
+                pairs.append((fernet, value))
+                slots.append((position, field))
+    
+    decrypted = [{} for _ in instances]
+    for (position, field), plaintext in zip(slots, decrypt_batch(pairs)):
+        decrypted[position][field] = plaintext
+    return decrypted
+
+
+def encrypt_rows(instances, values_list, fields):
+    """Encrypt the given fields of one plaintext dict per Password instance."""
+    pairs, slots = [], []
+    for position, (instance, values) in enumerate(zip(instances, values_list)):
+        fernet = instance.get_fernet()
+        for field in fields:
+            value = values.get(field)
+            if isinstance(value, str):
+                pairs.append((fernet, value))
+                slots.append((position, field))
+    
+    encrypted = [{} for _ in instances]
+    for (position, field), token in zip(slots, encrypt_batch(pairs)):
+        encrypted[position][field] = token
+    return encrypted
@@ -0,0 +1,47 @@
+import ipaddress
+from urllib.parse import urlsplit
+
+from .crypto import keyed_digest
+
+# Multi-label public suffixes we see in practice. Anything else is treated as a
+# single-label suffix, so the registrable domain is the last two labels.
+MULTI_LABEL_SUFFIXES = {
+    'co.uk', 'org.uk', 'ac.uk', 'gov.uk', 'me.uk',
+    'com.au', 'net.au', 'org.au', 'co.nz', 'co.jp', 'co.za', 'co.in',
+    'com.br', 'com.mx', 'com.ng', 'com.sg', 'com.cn', 'com.tr',
+    'co.ke', 'or.ke', 'ac.ke', 'go.ke', 'ne.ke', 'co.tz', 'co.ug',
+}
+
+
+def host_of(url):
+    """Lowercased host of a URL, accepting bare hosts such as 'github.com/login'."""
+    if not url:
+        return ''
+    url = url.strip()
+    try:
+        host = urlsplit(url if '//' in url else f'//{url}').hostname
+    except ValueError:
+        # Free text such as 'http://[oops' is not a URL at all.
+        return ''
+    return (host or '').lower().rstrip('.')
+
+
+def registrable_domain(host):
+    if not host:
+        return ''
+    try:
+        ipaddress.ip_address(host)
+        return host
+    except ValueError:
+        pass
+    labels = host.split('.')
+    if len(labels) > 2 and '.'.join(labels[-2:]) in MULTI_LABEL_SUFFIXES:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def domain_digest(owner_id, url):
+    domain = registrable_domain(host_of(url))
+    if not domain:
+        return None
+    return keyed_digest('domain', owner_id, domain)
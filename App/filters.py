@@ -1,6 +1,11 @@
-from django.db.models import Q
+from django.db.models import Q, Count
 from rest_framework.filters import BaseFilterBackend
 
+from .models import PasswordSearchToken
+from .search import search_digests
+
+#pylint: disable=no-member
+
 
 class MyDjangoFilter(BaseFilterBackend):
     def filter_queryset(self, request, queryset, view):
@@ -19,4 +24,23 @@ class MyDjangoFilter(BaseFilterBackend):
                 queryset = queryset.filter(filter_query)
                 return queryset
         else:
-            return queryset
\ No newline at end of file
+            return queryset
+
+class BlindIndexFilter(MyDjangoFilter):
+    """Search encrypted fields through the HMAC'd tokens in PasswordSearchToken."""
+    def filter_queryset(self, request, queryset, view):
+        search_param = request.query_params.get('search', None)
+        if search_param is None or search_param.strip() == '' or search_param.lower() == 'null':
+            return super().filter_queryset(request, queryset, view)
+        
+        digests = search_digests(request.user, search_param)
+        if not digests:
+            return queryset.none()
+        
+        matches = (
+            PasswordSearchToken.objects.filter(digest__in=digests)
+            .values('password')
+            .annotate(hits=Count('digest', distinct=True))
+            .filter(hits=len(digests))
+        )
+        return queryset.filter(id__in=matches.values('password'))
@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import get_user_model, login, alogin
+from django.contrib.auth.hashers import check_password, identify_hasher, make_password
+from django.contrib.auth.models import update_last_login
+from asgiref.sync import sync_to_async
+
+#pylint: disable=no-member
+
+
+class HashingPoolSaturated(Exception):
+    """Raised instead of queueing when every hashing slot is taken."""
+
+
+class HashingPool:
+    """A thread pool for password hashes that rejects work once max_pending jobs are in flight.
+
+    The PBKDF2 hasher releases the GIL, so a few threads keep every core busy
+    while request workers stay free to answer (or turn away) other requests.
+    """
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hashing')
+        self.slots = threading.BoundedSemaphore(max_pending)
+
+    def submit(self, func, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingPoolSaturated()
+        try:
+            future = self.executor.submit(func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_hashing_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = settings.LOGIN_HASH_WORKERS
+                _pool = HashingPool(workers, workers + settings.LOGIN_HASH_QUEUE_DEPTH)
+    return _pool
+
+
+def _check(user, password):
+    if user is None:
+        # Hash anyway so unknown emails take as long as wrong passwords.
+        make_password(password)
+        return False
+    return check_password(password, user.password)
+
+
+def _finish(user, password, valid):
+    if not valid or not user.is_active:
+        return None
+    if identify_hasher(user.password).must_update(user.password):
+        user.set_password(password)
+        user.save(update_fields=['password'])
+    return user
+
+
+def _lookup(email):
+    return get_user_model().objects.filter(email=email).first()
+
+
+def verify_credentials(email, password):
+    """authenticate() for the login views, with the hash run on the hashing pool.
+
+    Raises HashingPoolSaturated when the pool is full.
+    """
+    user = _lookup(email)
+    valid = get_hashing_pool().submit(_check, user, password).result()
+    return _finish(user, password, valid)
+
+
+async def averify_credentials(email, password):
+    user = await sync_to_async(_lookup)(email)
+    valid = await asyncio.wrap_future(get_hashing_pool().submit(_check, user, password))
+    if valid and identify_hasher(user.password).must_update(user.password):
+        return await sync_to_async(_finish)(user, password, valid)
+    return _finish(user, password, valid)
+
+
+def stateless_login(request):
+    """JWT clients can skip the session write with LOGIN_CREATE_SESSION=False or an X-Stateless-Login header."""
+    return not settings.LOGIN_CREATE_SESSION or request.headers.get('X-Stateless-Login', '').lower() in ('1', 'true')
+
+
+def record_login(request, user):
+    if stateless_login(request):
+        update_last_login(None, user)
+    else:
+        login(request, user)
+
+
+async def arecord_login(request, user):
+    if stateless_login(request):
+        await sync_to_async(update_last_login)(None, user)
+    else:
+        await alogin(request, user)
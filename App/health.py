@@ -0,0 +1,80 @@
+import math
+import string
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .crypto import keyed_digest
+
+#pylint: disable=no-member
+CHARACTER_CLASSES = [
+    (string.ascii_lowercase, 26),
+    (string.ascii_uppercase, 26),
+    (string.digits, 10),
+    (string.punctuation, 33),
+]
+# Entropy (in bits) needed for scores 1 to 4.
+STRENGTH_THRESHOLDS = [28, 40, 60, 80]
+
+
+def password_fingerprint(owner_id, password):
+    """Keyed per owner, so equal passwords only match within one vault."""
+    return keyed_digest('password', owner_id, password) if password else None
+
+
+def strength_score(password):
+    """Score a password from 0 (very weak) to 4 (strong) by estimated entropy.
+    
+    Repeated characters only count once, so 'aaaaaaaaaaaa' stays weak.
+    """
+    if not password:
+        return 0
+    pool = sum(size for characters, size in CHARACTER_CLASSES if any(c in characters for c in password))
+    if any(c not in string.printable for c in password):
+        pool += 100
+    entropy = len(set(password)) * math.log2(pool) + (len(password) - len(set(password)))
+    return sum(entropy >= threshold for threshold in STRENGTH_THRESHOLDS)
+
+
+def health_report(queryset):
+    """Summarise a vault from the stored fingerprints and scores, without decrypting anything."""
+    old_before = timezone.now() - timedelta(days=settings.HEALTH_PASSWORD_MAX_AGE_DAYS)
+    weak = Q(strength__lte=settings.HEALTH_WEAK_STRENGTH)
+    old = Q(password_changed_at__lt=old_before)
+    
+    totals = queryset.aggregate(
+        total=Count('id'),
+        weak=Count('id', filter=weak),
+        breached=Count('id', filter=Q(breached=True)),
+        old=Count('id', filter=old),
+    )
+    
+    reused_fingerprints = (
+        queryset.exclude(password_fingerprint__isnull=True)
+        .values('password_fingerprint')
+        .annotate(entries=Count('id'))
+        .filter(entries__gt=1)
+        .values('password_fingerprint')
+    )
+    groups = {}
+    rows = queryset.filter(password_fingerprint__in=reused_fingerprints).values_list('password_fingerprint', 'id')
+    for fingerprint, password_id in rows.order_by('password_fingerprint', 'id'):
+        groups.setdefault(fingerprint, []).append(password_id)
+    
+    flagged = {'weak': [], 'breached': [], 'old': []}
+    rows = queryset.filter(weak | old | Q(breached=True)).values_list('id', 'strength', 'breached', 'password_changed_at')
+    for password_id, strength, breached, changed_at in rows.order_by('id'):
+        if strength is not None and strength <= settings.HEALTH_WEAK_STRENGTH:
+            flagged['weak'].append(password_id)
+        if breached:
+            flagged['breached'].append(password_id)
+        if changed_at is not None and changed_at < old_before:
+            flagged['old'].append(password_id)
+    
+    reused = list(groups.values())
+    return {
+        **totals,
+        'reused': sum(len(group) for group in reused),
+        'entries': {**flagged, 'reused': reused},
+    }
@@ -0,0 +1,121 @@
+import logging
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.template.loader import get_template
+from django.utils import timezone
+from django.utils.html import strip_tags
+
+from .models import OutboundEmail
+from . import metrics
+
+#pylint: disable=no-member
+SENDER_NAME = 'The Two Devs Team'
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def _get_template(template_name):
+    return get_template(template_name)
+
+
+def queue_email(subject, template, context, recipient):
+    """Store an email in the outbox and hand it to the worker once the transaction commits."""
+    with metrics.timed('email'):
+        email = OutboundEmail.objects.create(
+            subject=subject,
+            recipient=recipient,
+            template=template,
+            context=context,
+        )
+    transaction.on_commit(_dispatch)
+    return email
+
+
+def _dispatch():
+    from .tasks import send_queued_emails
+    
+    try:
+        send_queued_emails.delay()
+    except Exception as e:
+        logger.warning("Error queueing email task: %s", e)
+
+
+def build_message(email, connection=None):
+    html_message = _get_template(email.template).render({**email.context, 'sender_name': SENDER_NAME})
+    message = EmailMultiAlternatives(
+        email.subject,
+        strip_tags(html_message),
+        f"{SENDER_NAME} <{settings.EMAIL_HOST_USER}>",
+        [email.recipient],
+        connection=connection,
+    )
+    message.attach_alternative(html_message, 'text/html')
+    return message
+
+
+def claim_due_emails(batch_size):
+    """Mark due outbox emails as sending and commit, so no lock is held while they are sent.
+    
+    A claim expires after EMAIL_OUTBOX_CLAIM_TIMEOUT seconds, so emails claimed
+    by a worker that died before recording the outcome are picked up again.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[OutboundEmail.PENDING, OutboundEmail.SENDING], next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        for email in emails:
+            email.status = OutboundEmail.SENDING
+            email.next_attempt_at = now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_TIMEOUT)
+        OutboundEmail.objects.bulk_update(emails, ['status', 'next_attempt_at'])
+    return emails
+
+
+def send_queued_emails(batch_size=None):
+    """Send due outbox emails over a single connection. Returns the number sent."""
+    emails = claim_due_emails(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    if not emails:
+        return 0
+    
+    sent = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for email in emails:
+            try:
+                connection.send_messages([build_message(email, connection)])
+            except Exception as e:
+                _schedule_retry(email, e)
+            else:
+                email.status = OutboundEmail.SENT
+                email.sent_at = timezone.now()
+                email.context = {}
+                sent += 1
+    except Exception as e:
+        for email in emails:
+            if email.status == OutboundEmail.SENDING:
+                _schedule_retry(email, e)
+    finally:
+        connection.close()
+    
+    OutboundEmail.objects.bulk_update(
+        emails, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at', 'context']
+    )
+    return sent
+
+
+def _schedule_retry(email, error):
+    logger.warning("Error sending email %s: %s", email.pk, error)
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboundEmail.FAILED
+    else:
+        email.status = OutboundEmail.PENDING
+        delay = settings.EMAIL_OUTBOX_RETRY_BACKOFF * 2 ** (email.attempts - 1)
+        email.next_attempt_at = timezone.now() + timedelta(seconds=delay)
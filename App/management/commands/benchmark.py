@@ -0,0 +1,57 @@
+import json
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment, override_settings
+from App import benchmarks
+from Manager.celery import app as celery_app
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the API hot paths against a throwaway test database and prints a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entries', type=int, default=1000, help='Number of vault entries to seed (100 to 100000).')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--scenarios', default=','.join(benchmarks.SCENARIOS))
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--baseline', help='A previous JSON report to compare against.')
+        parser.add_argument('--crypto-crossover', action='store_true', help='Also time inline against pooled batch decryption to find CRYPTO_PARALLEL_THRESHOLD.')
+        parser.add_argument('--serialization', action='store_true', help='Also time the DRF serializer and renderer against the list fast path over the whole vault.')
+        parser.add_argument('--max-regression', type=float, default=0.2, help='Allowed p95 growth over the baseline, as a fraction.')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = set(scenarios) - set(benchmarks.SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+        
+        celery_app.conf.task_always_eager = True
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            # Throttles still run, so their overhead is measured, but never trip.
+            rates = {scope: '1000000/s' for scope in settings.REST_FRAMEWORK.get('DEFAULT_THROTTLE_RATES', {})}
+            rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}
+            with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', REST_FRAMEWORK=rest_framework):
+                report = benchmarks.run(options['entries'], options['iterations'], scenarios, options['serialization'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        
+        if options['crypto_crossover']:
+            report['crypto_crossover'] = benchmarks.crypto_crossover()
+        
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                report['regressions'] = benchmarks.compare(report, json.load(f), options['max_regression'])
+        
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(benchmarks.dumps(report))
+        else:
+            self.stdout.write(benchmarks.dumps(report))
+        
+        if report.get('regressions'):
+            sys.exit(1)
@@ -0,0 +1,49 @@
+import hashlib
+from django.core.management.base import BaseCommand, CommandError
+from App.breach import build_filter
+
+
+class Command(BaseCommand):
+    help = 'Builds the offline breached-password filter from a downloaded corpus'
+
+    def add_arguments(self, parser):
+        parser.add_argument('corpus', help='One SHA-1 hash per line, optionally followed by :count (the Pwned Passwords format).')
+        parser.add_argument('output', help='Where to write the filter; point BREACH_FILTER_PATH at it.')
+        parser.add_argument('--plaintext', action='store_true', help='The corpus holds one plaintext password per line instead.')
+        parser.add_argument('--false-positive-rate', type=float, default=0.001)
+        parser.add_argument('--shard-bits', type=int, default=8, help='Shard by this many leading bits of the SHA-1 (0 to 24).')
+
+    def handle(self, *args, **options):
+        if not 0 <= options['shard_bits'] <= 24:
+            raise CommandError('--shard-bits must be between 0 and 24.')
+        if not 0 < options['false_positive_rate'] < 1:
+            raise CommandError('--false-positive-rate must be between 0 and 1.')
+        
+        malformed = [0]
+        
+        def read_digests():
+            malformed[0] = 0
+            with open(options['corpus'], encoding='utf-8', errors='replace') as corpus:
+                for line in corpus:
+                    line = line.rstrip('\r\n')
+                    if options['plaintext']:
+                        if line:
+                            yield hashlib.sha1(line.encode()).digest()
+                        continue
+                    value = line.split(':', 1)[0].strip()
+                    if len(value) == 40:
+                        try:
+                            yield bytes.fromhex(value)
+                            continue
+                        except ValueError:
+                            pass
+                    if value:
+                        malformed[0] += 1
+        
+        try:
+            total = build_filter(options['output'], read_digests, options['false_positive_rate'], options['shard_bits'])
+        except OSError as e:
+            raise CommandError(str(e))
+        if malformed[0]:
+            self.stderr.write(f'Skipped {malformed[0]} malformed lines.')
+        self.stdout.write(self.style.SUCCESS(f'Breach filter with {total} hashes written to {options["output"]}.'))
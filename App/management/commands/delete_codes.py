@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from App.tasks import purge_expired_codes
+
+
+#pylint: disable=no-member
+class Command(BaseCommand):
+    help = 'Purges expired password reset & verification codes and old password tombstones now; Celery beat runs the same purge from CELERY_BEAT_SCHEDULE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        for model, result in purge_expired_codes(options['batch_size']).items():
+            self.stdout.write(f"{model}: {result['deleted']} rows in {result['seconds']}s ({result['rows_per_second']} rows/s)")
@@ -0,0 +1,72 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from App.models import CustomUser, Password, PasswordSearchToken
+from App.search import SEARCHABLE_FIELDS, build_search_tokens
+from App.domains import domain_digest
+
+
+#pylint: disable=no-member
+class Command(BaseCommand):
+    help = 'Rebuilds the search tokens, site domain digests and health data of stored passwords'
+    reindexed_fields = ['site_domain_digest', *Password.PASSWORD_HEALTH_FIELDS]
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        rows = Password.objects.order_by('id')
+        last_id = None
+        total = 0
+        while True:
+            with transaction.atomic():
+                last_id, batch = self.lock_batch(rows.filter(id__gt=last_id) if last_id else rows, options['batch_size'])
+                if last_id is None:
+                    break
+                self.reindex(batch)
+            
+            total += len(batch)
+            self.stdout.write(f'{total} passwords reindexed.')
+        
+        self.stdout.write(self.style.SUCCESS('Vault reindex complete.'))
+
+    def lock_batch(self, rows, batch_size):
+        """Lock the next batch so concurrent edits wait instead of being overwritten.
+        
+        Writes lock the owner before the row (see Password.save), so the owners
+        are locked first here too. Returns the last id looked at (None when
+        done) and the rows still there once locked.
+        """
+        peek = list(rows.values_list('id', 'owner_id')[:batch_size])
+        if not peek:
+            return None, []
+        owners = sorted({owner_id for _, owner_id in peek})
+        list(CustomUser.objects.select_for_update().filter(pk__in=owners).order_by('pk').values_list('pk', flat=True))
+        batch = list(Password.objects.select_for_update().filter(id__in=[row_id for row_id, _ in peek]).order_by('id'))
+        return peek[-1][0], batch
+
+    def reindex(self, batch):
+        search_tokens = []
+        changed = {}
+        for instance in batch:
+            before = [getattr(instance, field) for field in self.reindexed_fields]
+            values = instance.decrypted([*SEARCHABLE_FIELDS, 'password'])
+            instance.site_domain_digest = domain_digest(instance.owner_id, values.get('site_url'))
+            backfill = instance.password_fingerprint is None
+            instance.apply_password_health(values.get('password'))
+            if backfill and instance.password_changed_at:
+                # The last write is the best guess for rows stored before health data.
+                instance.password_changed_at = instance.updated_at
+            search_tokens.extend(build_search_tokens(instance, values))
+            if before != [getattr(instance, field) for field in self.reindexed_fields]:
+                changed.setdefault(instance.owner_id, []).append(instance)
+        
+        # Rewritten rows get new revisions like any other write, so ETags and
+        # sync cursors taken before the reindex see them.
+        for owner_id, instances in changed.items():
+            first_revision = CustomUser.objects.next_vault_revision(owner_id, count=len(instances)) - len(instances) + 1
+            for i, instance in enumerate(instances):
+                instance.revision = first_revision + i
+                instance.version += 1
+        PasswordSearchToken.objects.filter(password__in=batch).delete()
+        PasswordSearchToken.objects.bulk_create(search_tokens)
+        Password.objects.bulk_update(batch, [*self.reindexed_fields, 'revision', 'version'])
@@ -0,0 +1,38 @@
+import time
+from django.core.management.base import BaseCommand
+from App.rotation import current_rotation, start_rotation, grace_remaining, rotate_rows
+from App.tasks import rotate_vault_keys
+
+
+class Command(BaseCommand):
+    help = 'Rotates user data keys and re-encrypts every stored password'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-rate', type=int, default=None, help='Maximum rows re-encrypted per second.')
+        parser.add_argument('--queue', action='store_true', help='Run the rotation in a Celery worker.')
+
+    def handle(self, *args, **options):
+        if options['queue']:
+            rotate_vault_keys.delay(options['batch_size'], options['max_rate'])
+            self.stdout.write(self.style.SUCCESS('Key rotation task scheduled successfully.'))
+            return
+        
+        rotation = current_rotation()
+        if rotation:
+            self.stdout.write(f'Resuming key rotation {rotation.id} after {rotation.rows_rotated} rows.')
+        rotation = start_rotation()
+        self.stdout.write(f'Data keys for key rotation {rotation.id} rewrapped.')
+        
+        wait = grace_remaining(rotation)
+        if wait:
+            self.stdout.write(f'Waiting {wait:.0f}s for cached data keys to expire.')
+            time.sleep(wait)
+        
+        rotate_rows(
+            rotation,
+            options['batch_size'],
+            options['max_rate'],
+            progress=lambda r: self.stdout.write(f'{r.rows_rotated} rows rotated.'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Key rotation {rotation.id} complete.'))
@@ -0,0 +1,119 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_current = ContextVar('request_metrics', default=None)
+
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+COUNT_BUCKETS = [0, 1, 2, 3, 5, 10, 20, 50, 100, 500]
+
+
+class RequestMetrics:
+    """Counters and timings collected while a single request is handled."""
+    def __init__(self):
+        self.timings = {}
+
+    def record(self, name, elapsed_ms, count=1):
+        total = self.timings.setdefault(name, [0, 0.0])
+        total[0] += count
+        total[1] += elapsed_ms
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record('db', (time.perf_counter() - started) * 1000)
+
+    def server_timing(self, total_ms):
+        entries = [
+            f'{name};dur={elapsed:.2f};desc="{count} calls"'
+            for name, (count, elapsed) in self.timings.items()
+        ]
+        entries.append(f'total;dur={total_ms:.2f}')
+        return ', '.join(entries)
+
+
+def start_request():
+    metrics = RequestMetrics()
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def record(name, elapsed_ms, count=1):
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.record(name, elapsed_ms, count)
+
+
+@contextmanager
+def timed(name, count=1):
+    """Time a block and add it to the current request's metrics, if any are being collected."""
+    if _current.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000, count)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.samples = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.samples += 1
+
+    def as_dict(self):
+        bounds = [str(bucket) for bucket in self.buckets] + ['+Inf']
+        return {
+            'buckets': dict(zip(bounds, self.counts)),
+            'sum': round(self.total, 3),
+            'count': self.samples,
+        }
+
+
+class Registry:
+    """Process-wide histograms of per-request metrics, keyed by route."""
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, metrics, total_ms):
+        with self._lock:
+            histograms = self._routes.setdefault(route, {})
+            self._histogram(histograms, 'total_ms', LATENCY_BUCKETS_MS).observe(total_ms)
+            for name, (count, elapsed) in metrics.timings.items():
+                self._histogram(histograms, f'{name}_ms', LATENCY_BUCKETS_MS).observe(elapsed)
+                self._histogram(histograms, f'{name}_count', COUNT_BUCKETS).observe(count)
+
+    def _histogram(self, histograms, name, buckets):
+        if name not in histograms:
+            histograms[name] = Histogram(buckets)
+        return histograms[name]
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                route: {name: histogram.as_dict() for name, histogram in histograms.items()}
+                for route, histograms in self._routes.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+registry = Registry()
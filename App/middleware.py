@@ -0,0 +1,46 @@
+import time
+from contextlib import ExitStack
+from django.db import connections
+
+from . import metrics, routers
+
+
+class InstrumentationMiddleware:
+    """Record per-request query, crypto and email timings.
+    
+    The totals are sent back in a Server-Timing header and added to the
+    in-process histograms served by the metrics endpoint.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_metrics, token = metrics.start_request()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(request_metrics.db_wrapper))
+                response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        total_ms = (time.perf_counter() - started) * 1000
+        
+        response['Server-Timing'] = request_metrics.server_timing(total_ms)
+        match = request.resolver_match
+        route = f"{request.method} /{match.route.strip('^$')}" if match else f"{request.method} <unresolved>"
+        metrics.registry.observe(route, request_metrics, total_ms)
+        return response
+
+
+class ReplicaPinningMiddleware:
+    """Start each request unpinned, so ReplicaRouter only pins requests that write."""
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = routers.start_request()
+        try:
+            return self.get_response(request)
+        finally:
+            routers.end_request(token)
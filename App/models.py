@@ -1,12 +1,17 @@
 import uuid
 import random
 import string
+from django.conf import settings
 from django.utils import timezone
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import RegexValidator
-from cryptography.fernet import Fernet
+
+from .crypto import encrypt_fields, decrypt_fields, encrypt_rows, decrypt_rows, get_fernet, get_user_fernet
+from .domains import domain_digest
+from .breach import is_breached
+from .health import password_fingerprint, strength_score
 
 #pylint: disable=no-member
 class UserManager(BaseUserManager):
@@ -33,6 +38,17 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
     
+    def next_vault_revision(self, user_id, count=1):
+        """Atomically advance a user's vault revision by count and return the new value.
+        
+        Writing several rows at once reserves one revision per row, so every
+        change in a vault has its own revision and the sync feed can be paged
+        on it.
+        """
+        with transaction.atomic(using=self._db, savepoint=False):
+            self.filter(pk=user_id).update(vault_revision=models.F('vault_revision') + count)
+            return self.filter(pk=user_id).values_list('vault_revision', flat=True).get()
+    
 
 class CustomUser(AbstractBaseUser, PermissionsMixin):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -45,12 +61,27 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     is_staff = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
     
+    wrapped_key = models.BinaryField(null=True, editable=False)
+    retired_key = models.BinaryField(null=True, editable=False)
+    vault_revision = models.PositiveBigIntegerField(default=0, editable=False)
+    # Newest revision whose tombstone has been purged; older sync cursors
+    # would miss that delete and have to sync from scratch.
+    purged_revision = models.PositiveBigIntegerField(default=0, editable=False)
+    
     USERNAME_FIELD = 'email'
+    QUERYSET_MANAGED_FIELDS = ['wrapped_key', 'retired_key', 'vault_revision', 'purged_revision']
     
     objects = UserManager()
     
     def save(self, *args, **kwargs):
         self.email = self.email.lower()
+        # Data keys and the vault revision are only written through queryset
+        # updates, so a stale instance must never write them back.
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.QUERYSET_MANAGED_FIELDS
+            ]
         super().save(*args, **kwargs)
     
     def has_module_perms(self, app_label):
@@ -68,19 +99,172 @@ class Password(models.Model):
     email_used = models.EmailField(null=True, blank=True)
     username_used = models.CharField(max_length=255, null=True, blank=True)
     password = models.CharField(max_length=128, null=True)
+    # Legacy per-row key. New rows are encrypted with the owner's data key instead.
     decryption_key = models.BinaryField(null=True)
+    site_domain_digest = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1)
+    revision = models.PositiveBigIntegerField(default=0)
+    breached = models.BooleanField(default=False)
+    # Health data derived from the plaintext password whenever it is written.
+    password_fingerprint = models.CharField(max_length=64, null=True, blank=True)
+    strength = models.PositiveSmallIntegerField(null=True, blank=True)
+    password_changed_at = models.DateTimeField(null=True, blank=True)
+    
+    ENCRYPTED_FIELDS = ['application_name', 'site_url', 'email_used', 'username_used', 'password']
+    PASSWORD_HEALTH_FIELDS = ['breached', 'password_fingerprint', 'strength', 'password_changed_at']
+    
+    def get_fernet(self):
+        if self.decryption_key:
+            return get_fernet(self.decryption_key)
+        return get_user_fernet(self.owner_id)
+    
+    def set_encrypted(self, values):
+        """Encrypt the declared secret fields present in values onto this instance."""
+        self._apply_encrypted(values, encrypt_fields(values, self.ENCRYPTED_FIELDS, self.get_fernet()))
+    
+    def _apply_encrypted(self, values, encrypted):
+        for field, value in encrypted.items():
+            setattr(self, field, value)
+        if 'site_url' in values:
+            self.site_domain_digest = domain_digest(self.owner_id, values['site_url'])
+        if 'password' in values:
+            self.apply_password_health(values['password'])
+    
+    def apply_password_health(self, password):
+        fingerprint = password_fingerprint(self.owner_id, password)
+        if fingerprint != self.password_fingerprint:
+            self.password_changed_at = timezone.now() if fingerprint else None
+        self.password_fingerprint = fingerprint
+        self.strength = strength_score(password) if password else None
+        self.breached = is_breached(password)
+    
+    def decrypted(self, fields=None):
+        """Return the plaintext of the given secret fields, all of them by default."""
+        return decrypt_fields(self, fields if fields is not None else self.ENCRYPTED_FIELDS, self.get_fernet())
+    
+    @classmethod
+    def set_encrypted_many(cls, instances, values_list):
+        """set_encrypted for a batch of instances, sharing the crypto pool."""
+        for instance, values, encrypted in zip(instances, values_list, encrypt_rows(instances, values_list, cls.ENCRYPTED_FIELDS)):
+            instance._apply_encrypted(values, encrypted)
+    
+    @classmethod
+    def decrypt_many(cls, instances, fields=None):
+        """decrypted() for a batch of instances, sharing the crypto pool."""
+        return decrypt_rows(instances, fields if fields is not None else cls.ENCRYPTED_FIELDS)
     
     def save(self, *args, **kwargs):
-        if not self.decryption_key:
-            fernet_key = Fernet.generate_key()
-            self.decryption_key = fernet_key
-        super().save(*args, **kwargs)
+        # Bumping the owner's revision locks the user row until commit, so
+        # revisions of one vault always become visible in order.
+        with transaction.atomic(savepoint=False):
+            self.revision = CustomUser.objects.next_vault_revision(self.owner_id)
+            if not self._state.adding:
+                self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = [*kwargs['update_fields'], 'updated_at', 'version', 'revision']
+            super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            PasswordTombstone.objects.create(
+                id=self.id,
+                owner_id=self.owner_id,
+                revision=CustomUser.objects.next_vault_revision(self.owner_id),
+            )
+            return super().delete(*args, **kwargs)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'revision']),
+            models.Index(fields=['owner', 'password_fingerprint']),
+        ]
+
+
+class PasswordTombstone(models.Model):
+    id = models.UUIDField(primary_key=True, editable=False)
+    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='password_tombstones')
+    revision = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'revision']),
+        ]
+    
+    @classmethod
+    def delete_expired(cls, batch_size=1000):
+        """Delete tombstones older than TOMBSTONE_RETENTION_DAYS in batches.
+        
+        Each vault's purged_revision is moved past the deleted tombstones in
+        the same transaction, so a cursor from before them is refused rather
+        than silently missing the deletes.
+        """
+        cutoff = timezone.now() - timezone.timedelta(days=settings.TOMBSTONE_RETENTION_DAYS)
+        expired = cls.objects.filter(deleted_at__lt=cutoff).order_by('deleted_at')
+        deleted = 0
+        while True:
+            batch = list(expired.values_list('pk', 'owner_id', 'revision')[:batch_size])
+            if not batch:
+                return deleted
+            newest = {}
+            for _, owner_id, revision in batch:
+                newest[owner_id] = max(revision, newest.get(owner_id, 0))
+            with transaction.atomic():
+                for owner_id, revision in newest.items():
+                    CustomUser.objects.filter(pk=owner_id, purged_revision__lt=revision).update(purged_revision=revision)
+                deleted += cls.objects.filter(pk__in=[pk for pk, _, _ in batch]).delete()[0]
+
+
+class KeyRotation(models.Model):
+    STAGED = 'staged'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    STATUS_CHOICES = [
+        (STAGED, 'Staged'),
+        (RUNNING, 'Running'),
+        (COMPLETE, 'Complete'),
+    ]
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STAGED)
+    started_at = models.DateTimeField(default=timezone.now)
+    keys_rewrapped_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_user_id = models.UUIDField(null=True, blank=True)
+    last_password_id = models.UUIDField(null=True, blank=True)
+    rows_rotated = models.PositiveBigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"Key rotation {self.id} ({self.status})"
+
+
+class PasswordSearchToken(models.Model):
+    password = models.ForeignKey(Password, on_delete=models.CASCADE, related_name='search_tokens')
+    digest = models.CharField(max_length=64, db_index=True)
+
+
+def delete_in_batches(queryset, batch_size=1000):
+    """Delete the rows of an ordered queryset batch_size at a time. Returns the number deleted."""
+    deleted = 0
+    while True:
+        batch = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return deleted
+        deleted += queryset.model.objects.filter(pk__in=batch).delete()[0]
+
+
+def delete_expired(code_model, batch_size=1000):
+    """Delete codes older than CODE_TTL, the same cutoff DatabaseCodeStore.verify uses."""
+    valid_after = timezone.now() - timezone.timedelta(seconds=settings.CODE_TTL)
+    return delete_in_batches(code_model.objects.filter(created_at__lt=valid_after).order_by('created_at'), batch_size)
 
 
 class VerificationCode(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='verification_code')
     code = models.CharField(unique=True, max_length=6)
-    created_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
 
     @classmethod
     def create_unique_code(cls):
@@ -88,23 +272,27 @@ class VerificationCode(models.Model):
         return ''.join(random.choices(string.digits, k=6))
 
     @classmethod
-    def create(cls, user):
-        """Create a new PasswordResetCode instance with a unique code."""
-        code = cls.create_unique_code()
-        return cls.objects.create(user=user, code=code)
+    def create(cls, user, retries=5):
+        """Create a new VerificationCode instance with a unique code, retrying on collisions."""
+        for _ in range(retries):
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(user=user, code=cls.create_unique_code())
+            except IntegrityError:
+                continue
+        raise IntegrityError('Could not generate a unique code.')
     
     @classmethod
-    def delete_expired_codes(cls):
-        """Delete verification codes older than 5 minutes."""
-        five_minutes_ago = timezone.now() - timezone.timedelta(minutes=5)
-        expired_codes = cls.objects.filter(created_at__lt=five_minutes_ago)
-        expired_codes.delete()
+    def delete_expired_codes(cls, batch_size=1000):
+        """Delete verification codes older than CODE_TTL in small batches. Returns the number deleted."""
+        return delete_expired(cls, batch_size)
         
         
 class PasswordResetCode(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='reset_codes')
     code = models.CharField(unique=True, max_length=6)
-    created_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
 
     @classmethod
     def create_unique_code(cls):
@@ -112,17 +300,52 @@ class PasswordResetCode(models.Model):
         return ''.join(random.choices(string.digits, k=6))
 
     @classmethod
-    def create(cls, user):
-        """Create a new PasswordResetCode instance with a unique code."""
-        code = cls.create_unique_code()
-        return cls.objects.create(user=user, code=code)
+    def create(cls, user, retries=5):
+        """Create a new PasswordResetCode instance with a unique code, retrying on collisions."""
+        for _ in range(retries):
+            try:
+                with transaction.atomic():
+                    return cls.objects.create(user=user, code=cls.create_unique_code())
+            except IntegrityError:
+                continue
+        raise IntegrityError('Could not generate a unique code.')
     
     @classmethod
-    def delete_expired_codes(cls):
-        """Delete reset codes older than 5 minutes."""
-        five_minutes_ago = timezone.now() - timezone.timedelta(minutes=5)
-        expired_codes = cls.objects.filter(created_at__lt=five_minutes_ago)
-        expired_codes.delete()
+    def delete_expired_codes(cls, batch_size=1000):
+        """Delete reset codes older than CODE_TTL in small batches. Returns the number deleted."""
+        return delete_expired(cls, batch_size)
+    
+    
+class OutboundEmail(models.Model):
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    ]
+    
+    subject = models.CharField(max_length=255)
+    recipient = models.EmailField()
+    template = models.CharField(max_length=100)
+    context = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
     
     
 class ApiUser(AbstractBaseUser, PermissionsMixin):
@@ -1,24 +1,120 @@
+import time
 import uuid
+from django.conf import settings
+from django.core.cache import cache, caches
 from rest_framework.permissions import BasePermission
 from rest_framework import exceptions
 
 from .models import APIKey
+from .caching import TTLCache
 
 #pylint: disable=no-member
+_api_key_cache = TTLCache(maxsize=settings.API_KEY_CACHE_SIZE, ttl=settings.API_KEY_CACHE_TTL)
+API_KEY_GENERATION_CACHE_KEY = 'api-key-generation'
+_key_generation = [0, float('-inf')]
+
+
+def _shared_cache():
+  if settings.API_KEY_CACHE_ALIAS:
+    return caches[settings.API_KEY_CACHE_ALIAS]
+  return None
+
+
+def _cache_key(key):
+  return f'api-key:{key}'
+
+
+def _generation_due():
+  return time.monotonic() - _key_generation[1] >= settings.API_KEY_GENERATION_CHECK_INTERVAL
+
+
+def api_key_generation():
+  """The shared API key generation, re-read at most every API_KEY_GENERATION_CHECK_INTERVAL seconds."""
+  if _generation_due():
+    _key_generation[:] = [cache.get(API_KEY_GENERATION_CACHE_KEY, 0), time.monotonic()]
+  return _key_generation[0]
+
+
+async def aapi_key_generation():
+  """Async counterpart of api_key_generation."""
+  if _generation_due():
+    _key_generation[:] = [await cache.aget(API_KEY_GENERATION_CACHE_KEY, 0), time.monotonic()]
+  return _key_generation[0]
+
+
+def get_api_user(key):
+  """Resolve the ApiUser owning an API key, checking the local and shared caches first."""
+  generation = api_key_generation()
+  cached = _api_key_cache.get(key)
+  if cached is not None and cached[0] == generation:
+    return cached[1]
+
+  api_user = None
+  shared_cache = _shared_cache()
+  if shared_cache is not None:
+    api_user = shared_cache.get(_cache_key(key))
+
+  if api_user is None:
+    api_key_obj = APIKey.objects.select_related('owner').get(api_key=key)
+    api_user = api_key_obj.owner
+    if shared_cache is not None:
+      shared_cache.set(_cache_key(key), api_user, settings.API_KEY_CACHE_TTL)
+
+  _api_key_cache.set(key, (generation, api_user))
+  return api_user
+
+
+async def aget_api_user(key):
+  """Async counterpart of get_api_user for views running on the event loop."""
+  generation = await aapi_key_generation()
+  cached = _api_key_cache.get(key)
+  if cached is not None and cached[0] == generation:
+    return cached[1]
+
+  api_user = None
+  shared_cache = _shared_cache()
+  if shared_cache is not None:
+    api_user = await shared_cache.aget(_cache_key(key))
+
+  if api_user is None:
+    api_key_obj = await APIKey.objects.select_related('owner').aget(api_key=key)
+    api_user = api_key_obj.owner
+    if shared_cache is not None:
+      await shared_cache.aset(_cache_key(key), api_user, settings.API_KEY_CACHE_TTL)
+
+  _api_key_cache.set(key, (generation, api_user))
+  return api_user
+
+
+def invalidate_api_key(key):
+  """Forget a changed or deleted key here, in the shared cache, and in every process sharing the default cache."""
+  key = str(key)
+  shared_cache = _shared_cache()
+  if shared_cache is not None:
+    shared_cache.delete(_cache_key(key))
+  try:
+    cache.incr(API_KEY_GENERATION_CACHE_KEY)
+  except ValueError:
+    cache.set(API_KEY_GENERATION_CACHE_KEY, 1, None)
+  _api_key_cache.clear()
+  _key_generation[1] = float('-inf')
+
+
 class APIKeyPermission(BasePermission):
   def has_permission(self, request, view):
-    key = request.headers.get('Authorization')
+    # Clients that also send a JWT in Authorization pass the key in X-API-Key.
+    key = request.headers.get('X-API-Key') or request.headers.get('Authorization')
     if not key:
       raise exceptions.AuthenticationFailed('API key is required')
     
     try:
-      uuid.UUID(key)
+      key = str(uuid.UUID(key))
     except ValueError:
       raise exceptions.AuthenticationFailed('Invalid API key')
 
     try:
-      api_key_obj = APIKey.objects.get(api_key=key)
+      request.api_user = get_api_user(key)
     except APIKey.DoesNotExist:
       raise exceptions.AuthenticationFailed('Invalid API key')
 
-    return True
\ No newline at end of file
+    return True
@@ -0,0 +1,19 @@
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class VaultJSONRenderer(JSONRenderer):
+    """JSONRenderer that uses orjson when it is installed.
+
+    Output matches the stock renderer in compact mode; pretty-printing
+    requests (an indent in the Accept header) go through the stock renderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(data, default=JSONEncoder().default, option=orjson.OPT_UTC_Z)
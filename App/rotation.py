@@ -0,0 +1,138 @@
+import time
+from datetime import timedelta
+from cryptography.fernet import Fernet, MultiFernet
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CustomUser, Password, KeyRotation
+from .crypto import wrap_key, unwrap_key, get_user_fernet, forget_data_keys, rotate_batch
+from .caching import is_shared
+
+#pylint: disable=no-member
+USER_BATCH_SIZE = 500
+
+
+def current_rotation():
+    return KeyRotation.objects.exclude(status=KeyRotation.COMPLETE).order_by('-started_at').first()
+
+
+def start_rotation():
+    """Return the unfinished rotation, or a new one, once every user's data key has been rewrapped."""
+    rotation = current_rotation() or KeyRotation.objects.create()
+    if rotation.keys_rewrapped_at is None:
+        rewrap_data_keys(rotation)
+    return rotation
+
+
+def rewrap_data_keys(rotation):
+    """Give every user a new data key and keep the old one as a read fallback.
+    
+    Keys are rewrapped with the first master key, so this also moves data keys
+    off retired master keys. Each user is rewrapped in its own transaction
+    together with the rotation's checkpoint, so an interrupted run resumes
+    after rotation.last_user_id without rewrapping anyone twice.
+    """
+    users = CustomUser.objects.filter(wrapped_key__isnull=False).order_by('id')
+    while True:
+        user_ids = list(
+            (users.filter(id__gt=rotation.last_user_id) if rotation.last_user_id else users)
+            .values_list('id', flat=True)[:USER_BATCH_SIZE]
+        )
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            with transaction.atomic():
+                wrapped_key = CustomUser.objects.select_for_update().values_list('wrapped_key', flat=True).get(pk=user_id)
+                CustomUser.objects.filter(pk=user_id).update(
+                    retired_key=wrap_key(unwrap_key(wrapped_key)),
+                    wrapped_key=wrap_key(Fernet.generate_key()),
+                )
+                rotation.last_user_id = user_id
+                rotation.save(update_fields=['last_user_id'])
+    
+    rotation.keys_rewrapped_at = timezone.now()
+    rotation.save(update_fields=['keys_rewrapped_at'])
+    forget_data_keys()
+
+
+def grace_remaining(rotation):
+    """Seconds until every process has dropped the data keys it cached before the rewrap.
+    
+    With a shared cache the generation stamp reaches every process within
+    DATA_KEY_GENERATION_CHECK_INTERVAL; otherwise wait out the cache TTL.
+    """
+    if is_shared(cache):
+        grace = settings.DATA_KEY_GENERATION_CHECK_INTERVAL
+    else:
+        grace = settings.DATA_KEY_CACHE_TTL
+    ready_at = rotation.keys_rewrapped_at + timedelta(seconds=grace)
+    return max(0.0, (ready_at - timezone.now()).total_seconds())
+
+
+def _rotate_batch(batch):
+    pairs, slots = [], []
+    for instance in batch:
+        if instance.decryption_key:
+            values = instance.decrypted()
+            instance.decryption_key = None
+            instance.set_encrypted(values)
+            continue
+        
+        fernet = get_user_fernet(instance.owner_id)
+        if not isinstance(fernet, MultiFernet):
+            continue
+        for field in Password.ENCRYPTED_FIELDS:
+            value = getattr(instance, field)
+            if isinstance(value, str):
+                pairs.append((fernet, value))
+                slots.append((instance, field))
+    
+    for (instance, field), token in zip(slots, rotate_batch(pairs)):
+        setattr(instance, field, token)
+
+
+def rotate_rows(rotation, batch_size=None, max_rows_per_second=None, progress=None):
+    """Re-encrypt Password rows in keyset-paginated batches, checkpointing after each one.
+    
+    Only the rows of the current batch are locked, and an interrupted run picks
+    up again from rotation.last_password_id.
+    """
+    batch_size = batch_size or settings.KEY_ROTATION_BATCH_SIZE
+    max_rows_per_second = max_rows_per_second or settings.KEY_ROTATION_MAX_ROWS_PER_SECOND
+    # Rows still on a legacy per-row key go through set_encrypted, which also
+    # rewrites the domain digest and health data, so load and save those too.
+    fields = [*Password.ENCRYPTED_FIELDS, 'decryption_key', 'site_domain_digest', *Password.PASSWORD_HEALTH_FIELDS]
+    
+    rotation.status = KeyRotation.RUNNING
+    rotation.save(update_fields=['status'])
+    
+    while True:
+        started = time.monotonic()
+        with transaction.atomic():
+            rows = Password.objects.select_for_update().order_by('id').only('id', 'owner_id', *fields)
+            if rotation.last_password_id:
+                rows = rows.filter(id__gt=rotation.last_password_id)
+            batch = list(rows[:batch_size])
+            if not batch:
+                break
+            
+            _rotate_batch(batch)
+            Password.objects.bulk_update(batch, fields)
+            
+            rotation.last_password_id = batch[-1].id
+            rotation.rows_rotated += len(batch)
+            rotation.save(update_fields=['last_password_id', 'rows_rotated'])
+        
+        if progress:
+            progress(rotation)
+        if max_rows_per_second:
+            time.sleep(max(0.0, len(batch) / max_rows_per_second - (time.monotonic() - started)))
+    
+    CustomUser.objects.filter(retired_key__isnull=False).update(retired_key=None)
+    forget_data_keys()
+    rotation.status = KeyRotation.COMPLETE
+    rotation.finished_at = timezone.now()
+    rotation.save(update_fields=['status', 'finished_at'])
+    return rotation
@@ -0,0 +1,87 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, DatabaseError
+
+#pylint: disable=no-member
+logger = logging.getLogger(__name__)
+_pinned = ContextVar('pinned_to_primary', default=False)
+_replica = ContextVar('replica', default=None)
+_unhealthy_until = {}
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+def pin_primary():
+    """Send the rest of the current request (or task) to the primary."""
+    _pinned.set(True)
+
+
+def start_request():
+    return _pinned.set(False), _replica.set(None)
+
+
+def end_request(tokens):
+    pinned_token, replica_token = tokens
+    _pinned.reset(pinned_token)
+    _replica.reset(replica_token)
+
+
+@contextmanager
+def use_primary():
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+def _healthy(alias):
+    if _unhealthy_until.get(alias, 0) > time.monotonic():
+        return False
+    try:
+        connections[alias].ensure_connection()
+    except DatabaseError as e:
+        logger.warning('Replica %s is unavailable, reading from the primary: %s', alias, e)
+        _unhealthy_until[alias] = time.monotonic() + settings.REPLICA_RETRY_AFTER
+        return False
+    return True
+
+
+class ReplicaRouter:
+    """Route reads to a healthy replica and everything else to the primary.
+
+    Reads stay on the primary inside transactions, once the request has
+    written anything (so it reads its own writes), and while every replica is
+    down. A request reads from a single replica, and a replica that fails to
+    connect is skipped for REPLICA_RETRY_AFTER seconds.
+    """
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        # Keep a request on one replica so its reads see a single point in time.
+        alias = _replica.get()
+        if alias is not None and _healthy(alias):
+            return alias
+        replicas = replica_aliases()
+        random.shuffle(replicas)
+        for alias in replicas:
+            if _healthy(alias):
+                _replica.set(alias)
+                return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,116 @@
+import re
+from django.conf import settings
+from rapidfuzz import fuzz, process
+
+from .models import Password, PasswordSearchToken
+from .crypto import keyed_digest, chunked
+from .caching import TTLCache
+from .domains import host_of
+
+#pylint: disable=no-member
+NGRAM_SIZE = 3
+SEARCHABLE_FIELDS = ['application_name', 'site_url', 'email_used', 'username_used']
+
+
+def _words(value):
+    return re.findall(r'\w+', value.strip().lower())
+
+
+def index_tokens(value):
+    """Words, short prefixes and n-grams of a plaintext value."""
+    tokens = set()
+    for word in _words(value):
+        tokens.add(word)
+        tokens.update(word[:size] for size in range(1, NGRAM_SIZE))
+        tokens.update(word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1))
+    return tokens
+
+
+def query_tokens(term):
+    """Tokens that every matching entry must have indexed."""
+    tokens = set()
+    for word in _words(term):
+        if len(word) < NGRAM_SIZE:
+            tokens.add(word)
+        else:
+            tokens.update(word[i:i + NGRAM_SIZE] for i in range(len(word) - NGRAM_SIZE + 1))
+    return tokens
+
+
+def token_digests(owner_id, tokens):
+    return {keyed_digest('search', owner_id, token) for token in tokens}
+
+
+def build_search_tokens(instance, values):
+    tokens = set()
+    for field in SEARCHABLE_FIELDS:
+        value = values.get(field)
+        if isinstance(value, str):
+            tokens.update(index_tokens(value))
+    return [PasswordSearchToken(password=instance, digest=digest) for digest in token_digests(instance.owner_id, tokens)]
+
+
+def index_password(instance, values, replace=True):
+    """Replace the blind index of a Password with tokens from its plaintext values."""
+    if replace:
+        PasswordSearchToken.objects.filter(password=instance).delete()
+    PasswordSearchToken.objects.bulk_create(build_search_tokens(instance, values))
+
+
+def search_digests(owner, term):
+    return token_digests(owner.id, query_tokens(term))
+
+
+class FuzzyIndex:
+    """Decrypted application names and site hosts of one vault, kept in memory for fuzzy matching."""
+    def __init__(self, version, ids, names, hosts):
+        self.version = version
+        self.ids = ids
+        self.names = names
+        self.match_names = [name.lower() for name in names]
+        self.hosts = hosts
+
+
+_fuzzy_indexes = TTLCache(maxsize=settings.FUZZY_INDEX_CACHE_SIZE, ttl=settings.FUZZY_INDEX_TTL)
+
+
+def get_fuzzy_index(owner):
+    """The owner's fuzzy index, rebuilt once their vault revision has moved.
+    
+    owner.vault_revision must be fresh (see views.refresh_vault_revision);
+    every write bumps it, in whichever process it happened.
+    """
+    version = owner.vault_revision
+    index = _fuzzy_indexes.get(owner.id)
+    if index is not None and index.version == version:
+        return index
+    
+    ids, names, hosts = [], [], []
+    rows = Password.objects.filter(owner=owner).only('id', 'owner_id', 'decryption_key', 'application_name', 'site_url')
+    for chunk in chunked(rows.iterator(chunk_size=1000), 1000):
+        for row, values in zip(chunk, Password.decrypt_many(chunk, ['application_name', 'site_url'])):
+            ids.append(row.id)
+            names.append(values.get('application_name', ''))
+            hosts.append(host_of(values.get('site_url')))
+    
+    index = FuzzyIndex(version, ids, names, hosts)
+    _fuzzy_indexes.set(owner.id, index)
+    return index
+
+
+def fuzzy_search(owner, term, limit=20):
+    """Rank an owner's entries by how closely their name or host matches term.
+    
+    Returns (index, [(position, score), ...]) with the best matches first.
+    """
+    index = get_fuzzy_index(owner)
+    query = term.strip().lower()
+    best = {}
+    for choices in (index.match_names, index.hosts):
+        matches = process.extract(
+            query, choices, scorer=fuzz.WRatio, processor=None,
+            limit=limit, score_cutoff=settings.FUZZY_SCORE_CUTOFF,
+        )
+        for _, score, position in matches:
+            best[position] = max(score, best.get(position, 0))
+    return index, sorted(best.items(), key=lambda item: item[1], reverse=True)[:limit]
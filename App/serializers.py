@@ -1,8 +1,20 @@
+from django.contrib.auth import password_validation
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
 from rest_framework import serializers
 
 from .models import CustomUser, Password, ApiUser, APIKey
 
 #pylint: disable=no-member
+def _validated_password(value):
+    # Runs AUTH_PASSWORD_VALIDATORS, including the breached-password check.
+    try:
+        password_validation.validate_password(value)
+    except DjangoValidationError as e:
+        raise serializers.ValidationError(list(e.messages))
+    return value
+
+
 class ResendCodeSerializer(serializers.Serializer):
     email = serializers.CharField()
     
@@ -14,6 +26,9 @@ class UserSerializer(serializers.ModelSerializer):
     email = serializers.CharField()
     password = serializers.CharField(write_only=True)
     
+    def validate_password(self, value):
+        return _validated_password(value)
+    
     def create(self, validated_data):
         user = CustomUser.objects.create(
             email = validated_data['email']
@@ -63,24 +78,76 @@ class PasswordSerializer(serializers.ModelSerializer):
     site_url = serializers.CharField(max_length=255)
     email_used = serializers.CharField()
     username_used = serializers.CharField(max_length=25)
-    password = serializers.CharField(required=False)
+    password = serializers.CharField(required=False, allow_blank=True)
     length = serializers.IntegerField(required=False)
     
     def create(self, validated_data):
-        new_password = Password.objects.create(
-            owner = self.context['request'].user,
-            application_name = validated_data['application_name'],
-            site_url = validated_data['site_url'],
-            email_used  = validated_data['email_used'],
-            username_used = validated_data['username_used'],
-            password=validated_data.get('password', ''),
-        )
+        new_password = Password(owner=self.context['request'].user)
+        new_password.set_encrypted({**validated_data, 'password': validated_data.get('password', '')})
         new_password.save()
         return new_password
     
+    def update(self, instance, validated_data):
+        instance.set_encrypted(validated_data)
+        update_fields = [field for field in Password.ENCRYPTED_FIELDS if field in validated_data]
+        if 'site_url' in validated_data:
+            update_fields.append('site_domain_digest')
+        if 'password' in validated_data:
+            update_fields.extend(Password.PASSWORD_HEALTH_FIELDS)
+        instance.save(update_fields=update_fields)
+        return instance
+    
     class Meta:
         model = Password
-        fields = ['id', 'owner', 'application_name', 'site_url', 'email_used', 'username_used', 'password', 'length']
+        fields = ['id', 'owner', 'application_name', 'site_url', 'email_used', 'username_used', 'password', 'length', 'created_at', 'updated_at', 'version', 'breached', 'strength', 'password_changed_at']
+        read_only_fields = ['created_at', 'updated_at', 'version', 'breached', 'strength', 'password_changed_at']
+
+
+
+def _datetime(value):
+    # Same output as DRF's DateTimeField.
+    if value is None:
+        return None
+    value = timezone.localtime(value).isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+class PasswordRowSerializer:
+    """A plain, non-reflective serializer for vault listings.
+
+    It only reads the requested attributes, so it pairs with .only() querysets,
+    and takes already decrypted values instead of decrypting itself.
+    """
+    FIELDS = ['id', 'owner', 'application_name', 'site_url', 'email_used', 'username_used', 'password', 'created_at', 'updated_at', 'version', 'breached', 'strength', 'password_changed_at']
+    
+    def __init__(self, fields=None):
+        self.fields = fields or list(self.FIELDS)
+    
+    @classmethod
+    def columns(cls, fields):
+        """The model fields to load for the given response fields."""
+        columns = {'id', 'owner_id', 'decryption_key'}
+        columns.update('owner_id' if field == 'owner' else field for field in fields)
+        return list(columns)
+    
+    def to_representation(self, instance, decrypted=None):
+        decrypted = decrypted or {}
+        data = {}
+        for field in self.fields:
+            if field in decrypted:
+                data[field] = decrypted[field]
+            elif field == 'id':
+                data[field] = str(instance.id)
+            elif field == 'owner':
+                data[field] = str(instance.owner_id)
+            elif field in ('created_at', 'updated_at', 'password_changed_at'):
+                data[field] = _datetime(getattr(instance, field))
+            else:
+                data[field] = getattr(instance, field)
+        return data
+    
+    def many(self, instances, decrypted):
+        return [self.to_representation(instance, values) for instance, values in zip(instances, decrypted)]
 
          
 class APIKeySerializer(serializers.ModelSerializer):
@@ -98,4 +165,7 @@ class PasswordResetSerializer(serializers.Serializer):
 class PasswordConfirmSerializer(serializers.Serializer):
     email = serializers.EmailField()
     verification_code = serializers.CharField()
-    new_password = serializers.CharField()
\ No newline at end of file
+    new_password = serializers.CharField()
+    
+    def validate_new_password(self, value):
+        return _validated_password(value)
\ No newline at end of file
@@ -0,0 +1,35 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import APIKey, ApiUser, QuickTip, CustomUser
+from .permissions import invalidate_api_key
+from .authentication import invalidate_cached_user
+from .async_views import QUICK_TIPS_CACHE_KEY
+
+
+#pylint: disable=no-member
+@receiver(post_save, sender=APIKey)
+@receiver(post_delete, sender=APIKey)
+def invalidate_cached_api_key(sender, instance, **kwargs):
+    invalidate_api_key(instance.api_key)
+
+
+@receiver(post_save, sender=ApiUser)
+def invalidate_cached_api_user_keys(sender, instance, created, **kwargs):
+    if created:
+        return
+    for api_key in APIKey.objects.filter(owner=instance).values_list('api_key', flat=True):
+        invalidate_api_key(api_key)
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_request_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=QuickTip)
+@receiver(post_delete, sender=QuickTip)
+def invalidate_cached_quick_tips(sender, instance, **kwargs):
+    cache.delete(QUICK_TIPS_CACHE_KEY)
@@ -0,0 +1,56 @@
+import logging
+import time
+from celery import shared_task
+from django.conf import settings
+
+from . import mail
+from .models import VerificationCode, PasswordResetCode, PasswordTombstone
+from .rotation import start_rotation, grace_remaining, rotate_rows
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def send_queued_emails():
+    """Drain due emails from the outbox."""
+    sent = mail.send_queued_emails()
+    while sent:
+        sent = mail.send_queued_emails()
+
+
+@shared_task
+def rotate_vault_keys(batch_size=None, max_rows_per_second=None):
+    """Start or resume a key rotation, waiting for cached data keys to be dropped first."""
+    rotation = start_rotation()
+    wait = grace_remaining(rotation)
+    if wait:
+        rotate_vault_keys.apply_async(
+            kwargs={'batch_size': batch_size, 'max_rows_per_second': max_rows_per_second},
+            countdown=wait,
+        )
+        return
+    rotate_rows(rotation, batch_size, max_rows_per_second)
+
+
+@shared_task
+def purge_expired_codes(batch_size=None):
+    """Delete expired verification and reset codes, and tombstones past
+    TOMBSTONE_RETENTION_DAYS, in bounded batches and report the throughput."""
+    batch_size = batch_size or settings.CODE_PURGE_BATCH_SIZE
+    report = {}
+    purges = [
+        (VerificationCode, VerificationCode.delete_expired_codes),
+        (PasswordResetCode, PasswordResetCode.delete_expired_codes),
+        (PasswordTombstone, PasswordTombstone.delete_expired),
+    ]
+    for model, purge in purges:
+        started = time.monotonic()
+        deleted = purge(batch_size=batch_size)
+        elapsed = time.monotonic() - started
+        report[model.__name__] = {
+            'deleted': deleted,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(deleted / elapsed, 1) if elapsed else 0,
+        }
+        logger.info('Purged %s expired %s rows in %.3fs', deleted, model.__name__, elapsed)
+    return report
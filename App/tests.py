@@ -0,0 +1,1110 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+import warnings
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPException
+from contextlib import ExitStack, contextmanager
+from unittest import mock, skipUnless
+import psycopg
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.mail.backends import locmem
+from django.db import DatabaseError, connection, connections
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_celery_beat.models import PeriodicTask
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .models import CustomUser, Password, PasswordSearchToken, PasswordTombstone, OutboundEmail, ApiUser, APIKey, KeyRotation, VerificationCode, PasswordResetCode
+from .codes import CacheCodeStore, DatabaseCodeStore, get_code_store, VERIFICATION, RESET
+from .crypto import get_user_fernet, forget_data_keys, wrap_key, KEY_GENERATION_CACHE_KEY
+from .rotation import current_rotation, start_rotation, rotate_rows
+from .archive import read_archive, ArchiveError
+from .breach import BreachFilter, build_filter, get_breach_filter
+from .hashing import HashingPool, HashingPoolSaturated
+from .throttling import _buckets
+from .authentication import _users
+from .permissions import get_api_user, API_KEY_GENERATION_CACHE_KEY, _api_key_cache, _key_generation
+from .routers import ReplicaRouter, _unhealthy_until, replica_aliases, start_request, end_request, use_primary
+from .tasks import purge_expired_codes
+from . import breach as breach_module
+from . import metrics
+from . import mail as outbox
+from . import rotation as rotation_module
+
+#pylint: disable=no-member
+def forget_api_keys_locally():
+    _api_key_cache.clear()
+    _key_generation[1] = float('-inf')
+
+
+class BouncingEmailBackend(locmem.EmailBackend):
+    """locmem backend that fails for any recipient at bounce.test and notes each email's status while it is sent."""
+    statuses = []
+
+    def send_messages(self, messages):
+        for message in messages:
+            self.statuses.append(OutboundEmail.objects.get(recipient=message.to[0]).status)
+            if message.to[0].endswith('@bounce.test'):
+                raise SMTPException('Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='App.tests.BouncingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(TestCase):
+    def setUp(self):
+        BouncingEmailBackend.statuses = []
+
+    def queue(self, recipient):
+        return OutboundEmail.objects.create(
+            subject='Account Verification Code',
+            recipient=recipient,
+            template='verification_email.html',
+            context={'verification_code': '123456'},
+        )
+
+    def test_drain_sends_due_emails_after_claiming_them(self):
+        first, second = self.queue('a@example.com'), self.queue('b@example.com')
+
+        self.assertEqual(outbox.send_queued_emails(), 2)
+        self.assertEqual(outbox.send_queued_emails(), 0)
+
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['a@example.com', 'b@example.com'])
+        self.assertEqual(BouncingEmailBackend.statuses, [OutboundEmail.SENDING] * 2)
+        for email in (first, second):
+            email.refresh_from_db()
+            self.assertEqual(email.status, OutboundEmail.SENT)
+            self.assertEqual(email.context, {})
+
+    def test_failed_email_is_retried_with_backoff_then_given_up(self):
+        email = self.queue('nobody@bounce.test')
+
+        with self.assertLogs('App.mail', 'WARNING'):
+            self.assertEqual(outbox.send_queued_emails(), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(outbox.send_queued_emails(), 0)
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+        with self.assertLogs('App.mail', 'WARNING'):
+            outbox.send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.FAILED, 2))
+        self.assertIn('Mailbox unavailable', email.last_error)
+        self.assertEqual(mail.outbox, [])
+
+    def test_expired_claim_is_sent_again(self):
+        email = self.queue('a@example.com')
+        self.assertEqual(outbox.claim_due_emails(10), [email])
+        self.assertEqual(outbox.send_queued_emails(), 0)
+
+        OutboundEmail.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(outbox.send_queued_emails(), 1)
+
+
+@override_settings(API_KEY_GENERATION_CHECK_INTERVAL=0)
+class APIKeyCacheTests(TestCase):
+    def setUp(self):
+        forget_api_keys_locally()
+        api_user = ApiUser.objects.create(email='client@example.com', first_name='Test', last_name='Client')
+        self.api_key = APIKey.objects.create(owner=api_user)
+        self.key = str(self.api_key.api_key)
+
+    def test_validated_keys_are_served_from_memory(self):
+        with self.assertNumQueries(1):
+            owner = get_api_user(self.key)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_api_user(self.key), owner)
+
+    def test_a_key_changed_in_another_process_is_dropped_here(self):
+        get_api_user(self.key)
+        # Another worker deletes the key: the row and the shared stamp change,
+        # this process's memory does not.
+        APIKey.objects.filter(pk=self.api_key.pk).update(api_key=uuid.uuid4())
+        cache.set(API_KEY_GENERATION_CACHE_KEY, cache.get(API_KEY_GENERATION_CACHE_KEY, 0) + 1, None)
+        with self.settings(API_KEY_GENERATION_CHECK_INTERVAL=3600):
+            get_api_user(self.key)
+        with self.assertRaises(APIKey.DoesNotExist):
+            get_api_user(self.key)
+
+    def test_deleting_a_key_rejects_it_straight_away(self):
+        headers = {'HTTP_X_API_KEY': self.key}
+        self.assertEqual(self.client.get('/api/v1/dashboard/quick-tips/', **headers).status_code, 200)
+        self.api_key.delete()
+        self.assertEqual(self.client.get('/api/v1/dashboard/quick-tips/', **headers).status_code, 401)
+
+
+class VaultTestCase(TestCase):
+    """Signs requests with an API key and a JWT for a verified vault owner."""
+    @classmethod
+    def setUpTestData(cls):
+        api_user = ApiUser.objects.create(email='client@example.com', first_name='Test', last_name='Client')
+        cls.api_key = str(APIKey.objects.create(owner=api_user).api_key)
+        cls.user = CustomUser.objects.create_user(email='owner@example.com', password='correct horse battery')
+        cls.user.is_verified = True
+        cls.user.save()
+
+    def headers(self, user=None):
+        return {
+            'HTTP_X_API_KEY': self.api_key,
+            'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user or self.user)}',
+        }
+
+    def create_entry(self, name='GitHub', **values):
+        body = {
+            'application_name': name,
+            'site_url': f'https://{name.lower()}.example.com',
+            'email_used': 'owner@example.com',
+            'username_used': 'owner',
+            'password': f'{name}-secret',
+            **values,
+        }
+        response = self.client.post('/api/v1/dashboard/passwords/', body, content_type='application/json', **self.headers())
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()
+
+
+@modify_settings(MIDDLEWARE={'prepend': 'App.middleware.InstrumentationMiddleware'})
+class InstrumentationTests(VaultTestCase):
+    def setUp(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+
+    def test_server_timing_header(self):
+        response = self.client.post('/api/v1/dashboard/passwords/', {
+            'application_name': 'GitHub', 'site_url': 'https://github.com', 'email_used': 'owner@example.com',
+            'username_used': 'owner', 'password': 'GitHub-secret',
+        }, content_type='application/json', **self.headers())
+        self.assertEqual(response.status_code, 201, response.content)
+        timings = {entry.split(';')[0]: entry for entry in response['Server-Timing'].split(', ')}
+        self.assertRegex(timings['db'], r'^db;dur=\d+\.\d{2};desc="\d+ calls"$')
+        self.assertRegex(timings['encrypt'], r'^encrypt;dur=\d+\.\d{2};desc="\d+ calls"$')
+        self.assertRegex(timings['total'], r'^total;dur=\d+\.\d{2}$')
+
+    def test_metrics_endpoint_returns_histograms_by_route(self):
+        self.create_entry('GitHub')
+        self.create_entry('GitLab')
+        self.client.get('/api/v1/dashboard/passwords/', **self.headers())
+
+        response = self.client.get('/api/v1/metrics/', HTTP_X_API_KEY=self.api_key)
+        self.assertEqual(response.status_code, 200)
+        routes = response.json()['routes']
+        self.assertEqual(set(routes), {'POST /api/v1/dashboard/passwords/', 'GET /api/v1/dashboard/passwords/'})
+        created = routes['POST /api/v1/dashboard/passwords/']
+        self.assertEqual(created['total_ms']['count'], 2)
+        self.assertEqual(sum(created['total_ms']['buckets'].values()), 2)
+        self.assertEqual(list(created['total_ms']['buckets']), [str(bucket) for bucket in metrics.LATENCY_BUCKETS_MS] + ['+Inf'])
+        self.assertEqual(created['encrypt_count']['count'], 2)
+        self.assertEqual(list(created['encrypt_count']['buckets']), [str(bucket) for bucket in metrics.COUNT_BUCKETS] + ['+Inf'])
+        self.assertEqual(created['db_count']['count'], 2)
+        self.assertEqual(routes['GET /api/v1/dashboard/passwords/']['total_ms']['count'], 1)
+
+        self.assertIn('GET /api/v1/metrics/', self.client.get('/api/v1/metrics/', HTTP_X_API_KEY=self.api_key).json()['routes'])
+
+
+class AuthUserCacheTests(VaultTestCase):
+    def setUp(self):
+        _users.clear()
+
+    def health(self):
+        return self.client.get('/api/v1/dashboard/passwords/health/', **self.headers())
+
+    def deactivate_elsewhere(self):
+        # Another worker's update: no signal reaches this process.
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+
+    @mock.patch('App.authentication.is_shared', return_value=False)
+    def test_users_are_loaded_per_request_without_a_shared_cache(self, _):
+        self.assertEqual(self.health().status_code, 200)
+        self.deactivate_elsewhere()
+        self.assertEqual(self.health().status_code, 401)
+
+    def test_users_are_cached_until_their_stamp_moves_with_a_shared_cache(self):
+        with mock.patch('App.authentication.is_shared', return_value=True):
+            self.assertEqual(self.health().status_code, 200)
+            self.deactivate_elsewhere()
+            self.assertEqual(self.health().status_code, 200)
+            cache.set(f'user-version:{self.user.pk}', 'bumped elsewhere', None)
+            self.assertEqual(self.health().status_code, 401)
+
+class PasswordWriteTests(VaultTestCase):
+    @mock.patch('App.authentication.is_shared', return_value=True)
+    def test_create_query_count(self, _):
+        self.create_entry('Warmup')
+        # Savepoint, revision bump and read, row insert, token insert, release.
+        with self.assertNumQueries(6):
+            self.create_entry()
+
+    def test_create_writes_row_and_search_tokens_together(self):
+        with mock.patch.object(PasswordSearchToken.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                self.create_entry()
+        self.assertFalse(Password.objects.exists())
+        self.assertFalse(PasswordSearchToken.objects.exists())
+
+        entry = self.create_entry()
+        self.assertTrue(PasswordSearchToken.objects.filter(password_id=entry['id']).exists())
+
+    def test_update_replaces_search_tokens(self):
+        entry = self.create_entry()
+        response = self.client.patch(
+            f"/api/v1/dashboard/passwords/{entry['id']}/", {'application_name': 'Gitea'},
+            content_type='application/json', **self.headers(),
+        )
+        self.assertEqual(response.status_code, 200)
+        results = self.client.get('/api/v1/dashboard/passwords/?search=gitea', **self.headers()).json()['results']
+        self.assertEqual([result['id'] for result in results], [entry['id']])
+
+
+class AutofillTests(VaultTestCase):
+    def autofill(self, url):
+        return self.client.get('/api/v1/dashboard/passwords/autofill/', {'url': url}, **self.headers())
+
+    def test_matches_the_registrable_domain_with_exact_hosts_first(self):
+        self.create_entry('Gist', site_url='https://gist.github.com')
+        self.create_entry('GitHub', site_url='github.com/login')
+        self.create_entry('Dropbox', site_url='https://dropbox.com')
+
+        response = self.autofill('https://GitHub.com/session')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(entry['application_name'], entry['exact_match']) for entry in response.json()], [('GitHub', True), ('Gist', False)])
+
+    def test_malformed_urls_are_rejected_not_crashed_on(self):
+        self.create_entry('Broken', site_url='http://[oops')
+        for url in ('http://[oops', ''):
+            self.assertEqual(self.autofill(url).status_code, 400, url)
+
+
+class HealthReportTests(VaultTestCase):
+    def test_counts_match_a_known_vault(self):
+        with mock.patch('App.models.is_breached', side_effect=lambda password: password == 'hunter2hunter2'):
+            weak = self.create_entry('Forum', password='aaaaaaaaaaaa')
+            reused = [self.create_entry(name, password='Shared-Passphrase-2024!') for name in ('GitHub', 'GitLab')]
+            breached = self.create_entry('Bank', password='hunter2hunter2')
+            old = self.create_entry('Email', password='Old-But-Unique-Phrase-99')
+        Password.objects.filter(pk=old['id']).update(password_changed_at=timezone.now() - timedelta(days=settings.HEALTH_PASSWORD_MAX_AGE_DAYS + 1))
+
+        other = CustomUser.objects.create_user(email='other@example.com', password='correct horse battery')
+        body = {'application_name': 'GitHub', 'site_url': 'https://github.com', 'email_used': 'other@example.com', 'username_used': 'other', 'password': 'Shared-Passphrase-2024!'}
+        self.assertEqual(self.client.post('/api/v1/dashboard/passwords/', body, content_type='application/json', **self.headers(other)).status_code, 201)
+
+        report = self.client.get('/api/v1/dashboard/passwords/health/', **self.headers()).json()
+        self.assertEqual(report, {
+            'total': 5,
+            'weak': 1,
+            'breached': 1,
+            'old': 1,
+            'reused': 2,
+            'entries': {
+                'weak': [weak['id']],
+                'breached': [breached['id']],
+                'old': [old['id']],
+                'reused': [sorted(entry['id'] for entry in reused)],
+            },
+        })
+
+
+class SyncFeedTests(VaultTestCase):
+    def sync(self, since, page_size=2):
+        response = self.client.get(f'/api/v1/dashboard/passwords/?since={since}&page_size={page_size}', **self.headers())
+        return response.status_code, response.json()
+
+    def test_feed_is_paged_by_revision(self):
+        first = self.create_entry('GitHub')
+        self.create_entry('GitLab')
+        response = self.client.post('/api/v1/dashboard/passwords/import/', {'entries': [
+            {'application_name': name, 'site_url': f'https://{name.lower()}.example.com', 'email_used': 'owner@example.com', 'username_used': 'owner', 'password': 'secret'}
+            for name in ('Gitea', 'Gogs', 'Forgejo')
+        ]}, content_type='application/json', **self.headers())
+        self.assertEqual(response.status_code, 201, response.content)
+        self.client.delete(f"/api/v1/dashboard/passwords/{first['id']}/", **self.headers())
+
+        changed, deleted, pages, since = [], [], 0, 0
+        while True:
+            _, body = self.sync(since)
+            self.assertLessEqual(len(body['changed']) + len(body['deleted']), 2)
+            changed += [entry['application_name'] for entry in body['changed']]
+            deleted += body['deleted']
+            pages += 1
+            since = body['cursor']
+            if body['next'] is None:
+                break
+            self.assertEqual(body['next'], since)
+        self.assertEqual(pages, 3)
+        self.assertEqual(changed, ['GitLab', 'Gitea', 'Gogs', 'Forgejo'])
+        self.assertEqual(deleted, [first['id']])
+        self.assertEqual(self.sync(since)[1], {'cursor': since, 'next': None, 'changed': [], 'deleted': []})
+
+    def test_rows_sharing_a_revision_stay_on_one_page(self):
+        for name in ('GitHub', 'GitLab', 'Gitea'):
+            self.create_entry(name)
+        Password.objects.update(revision=1)
+
+        _, body = self.sync(0)
+        self.assertEqual(len(body['changed']), 3)
+        self.assertEqual(body['next'], 1)
+
+    def test_feed_formats_timestamps_like_the_listing(self):
+        self.create_entry()
+        listed = self.client.get('/api/v1/dashboard/passwords/', **self.headers()).json()['results'][0]
+        for query in ('', '&fields=id,created_at,updated_at'):
+            response = self.client.get(f'/api/v1/dashboard/passwords/?since=0{query}', **self.headers())
+            changed = response.json()['changed'][0]
+            self.assertEqual(changed['created_at'], listed['created_at'])
+            self.assertEqual(changed['updated_at'], listed['updated_at'])
+        self.assertTrue(changed['created_at'].endswith('+03:00'))
+
+    def test_cursor_from_before_purged_tombstones_is_refused(self):
+        entry = self.create_entry()
+        _, body = self.sync(0)
+        self.client.delete(f"/api/v1/dashboard/passwords/{entry['id']}/", **self.headers())
+        PasswordTombstone.objects.update(deleted_at=timezone.now() - timedelta(days=settings.TOMBSTONE_RETENTION_DAYS + 1))
+
+        self.assertEqual(purge_expired_codes()['PasswordTombstone']['deleted'], 1)
+        self.assertEqual(self.sync(body['cursor'])[0], 410)
+        self.assertEqual(self.sync(0)[1]['changed'], [])
+
+    def test_reindex_locks_each_batch_in_its_own_transaction(self):
+        for name in ('GitHub', 'GitLab', 'Gitea'):
+            self.create_entry(name)
+        with CaptureQueriesContext(connection) as captured:
+            call_command('reindex_vaults', '--batch-size', '2', stdout=StringIO())
+        queries = [query['sql'] for query in captured]
+        # Two batches and the empty read that ends the run.
+        self.assertEqual(sum(sql.startswith('SAVEPOINT') for sql in queries), 3)
+        if connection.features.has_select_for_update:
+            locked = [sql for sql in queries if sql.endswith('FOR UPDATE')]
+            self.assertEqual(len(locked), 4)
+            self.assertTrue(all('"App_customuser"' in sql for sql in locked[::2]))
+
+    def test_reindex_moves_rewritten_rows_past_existing_cursors(self):
+        entry = self.create_entry()
+        self.create_entry('GitLab')
+        _, body = self.sync(0)
+        Password.objects.filter(pk=entry['id']).update(strength=None)
+
+        call_command('reindex_vaults', stdout=StringIO())
+        _, changes = self.sync(body['cursor'])
+        self.assertEqual([row['id'] for row in changes['changed']], [entry['id']])
+        self.assertEqual(changes['changed'][0]['version'], entry['version'] + 1)
+
+
+class SparseFieldsetQueryTests(VaultTestCase):
+    """A ?fields= listing takes the same number of queries however many rows it returns."""
+    def count_queries(self, query):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(f'/api/v1/dashboard/passwords/?{query}', **self.headers())
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(captured), response.json()
+
+    def assertConstantQueries(self, query):
+        for name in ('GitHub', 'GitLab'):
+            self.create_entry(name)
+        few, _ = self.count_queries(query)
+        for name in ('Gitea', 'Gogs', 'GitBucket', 'Gitee'):
+            self.create_entry(name)
+        many, body = self.count_queries(query)
+        self.assertEqual(few, many)
+        return body
+
+    def test_page(self):
+        body = self.assertConstantQueries('fields=id')
+        self.assertEqual(len(body['results']), 6)
+        self.assertEqual(set(body['results'][0]), {'id'})
+
+    def test_changes(self):
+        body = self.assertConstantQueries('fields=id,site_url&since=0')
+        self.assertEqual(len(body['changed']), 6)
+        self.assertEqual(set(body['changed'][0]), {'id', 'site_url'})
+        self.assertTrue(body['changed'][0]['site_url'].startswith('https://'))
+
+    def test_fuzzy(self):
+        body = self.assertConstantQueries('fields=id,application_name&search=git&fuzzy=true')
+        self.assertGreater(len(body['results']), 2)
+        self.assertEqual(set(body['results'][0]), {'id', 'application_name', 'score'})
+        self.assertTrue(body['results'][0]['application_name'].startswith('Git'))
+
+
+class StaleRequestUserTests(VaultTestCase):
+    """Another worker's write only reaches this process through the database."""
+    def get(self, path, etag=None):
+        headers = {**self.headers(), **({'HTTP_IF_NONE_MATCH': etag} if etag else {})}
+        return self.client.get(f'/api/v1/dashboard/passwords/{path}', **headers)
+
+    def write_elsewhere(self, name):
+        with mock.patch('App.authentication.invalidate_cached_user'):
+            store_password(self.user, name)
+
+    def test_etags_and_fuzzy_index_follow_writes_from_other_workers(self):
+        self.create_entry('Dropbox')
+        listing, health = self.get(''), self.get('health/')
+        self.assertEqual(self.get('?search=gitlab&fuzzy=true').json()['results'], [])
+
+        self.write_elsewhere('GitLab')
+        self.assertEqual(self.get('', listing['ETag']).status_code, 200)
+        self.assertEqual(self.get('health/', health['ETag']).status_code, 200)
+        results = self.get('?search=gitlab&fuzzy=true').json()['results']
+        self.assertEqual([result['application_name'] for result in results], ['GitLab'])
+
+
+def store_password(owner, name, legacy=False):
+    entry = Password(owner=owner, decryption_key=Fernet.generate_key() if legacy else None)
+    entry.set_encrypted({'application_name': name, 'site_url': f'https://{name.lower()}.example.com', 'password': f'{name}-secret'})
+    entry.save()
+    return entry
+
+
+@override_settings(DATA_KEY_GENERATION_CHECK_INTERVAL=0)
+class KeyRotationTests(TestCase):
+    def setUp(self):
+        self.users = sorted(
+            (CustomUser.objects.create_user(email=f'user{i}@example.com', password='unused') for i in range(2)),
+            key=lambda user: user.id,
+        )
+        for user in self.users:
+            store_password(user, 'GitHub')
+            store_password(user, 'GitLab')
+        self.plaintext = self.decrypt_all()
+
+    def decrypt_all(self):
+        rows = list(Password.objects.order_by('id'))
+        return {row.id: values for row, values in zip(rows, Password.decrypt_many(rows))}
+
+    def keys(self, user):
+        return CustomUser.objects.values_list('wrapped_key', 'retired_key').get(pk=user.pk)
+
+    def test_rotation_rewraps_keys_and_reencrypts_rows(self):
+        old_keys = [self.keys(user) for user in self.users]
+        old_tokens = dict(Password.objects.values_list('id', 'password'))
+
+        rotation = rotate_rows(start_rotation())
+
+        self.assertEqual((rotation.status, rotation.rows_rotated), (KeyRotation.COMPLETE, 4))
+        for user, (old_wrapped, _) in zip(self.users, old_keys):
+            wrapped, retired = self.keys(user)
+            self.assertNotEqual(bytes(wrapped), bytes(old_wrapped))
+            self.assertIsNone(retired)
+        for row_id, token in Password.objects.values_list('id', 'password'):
+            self.assertNotEqual(token, old_tokens[row_id])
+        self.assertEqual(self.decrypt_all(), self.plaintext)
+
+    def test_interrupted_rewrap_resumes_after_the_last_user(self):
+        first, second = self.users
+        calls = []
+
+        def crash_on_second_user(key):
+            calls.append(key)
+            if len(calls) == 3:
+                raise RuntimeError('worker killed')
+            return wrap_key(key)
+
+        with mock.patch.object(rotation_module, 'wrap_key', side_effect=crash_on_second_user):
+            with self.assertRaises(RuntimeError):
+                start_rotation()
+
+        rotation = current_rotation()
+        self.assertEqual(rotation.last_user_id, first.id)
+        self.assertIsNone(rotation.keys_rewrapped_at)
+        first_keys = self.keys(first)
+        self.assertIsNotNone(first_keys[1])
+        self.assertIsNone(self.keys(second)[1])
+        self.assertEqual(self.decrypt_all(), self.plaintext)
+
+        resumed = start_rotation()
+        self.assertEqual(resumed.pk, rotation.pk)
+        self.assertEqual(self.keys(first), first_keys)
+        self.assertIsNotNone(self.keys(second)[1])
+        rotate_rows(resumed)
+        self.assertEqual(self.decrypt_all(), self.plaintext)
+
+    def test_interrupted_row_rotation_resumes_from_checkpoint(self):
+        rotate_batch = rotation_module._rotate_batch
+        calls = []
+
+        def crash_on_second_batch(batch):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise RuntimeError('worker killed')
+            rotate_batch(batch)
+
+        rotation = start_rotation()
+        with mock.patch.object(rotation_module, '_rotate_batch', side_effect=crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                rotate_rows(rotation, batch_size=1)
+
+        rotation = current_rotation()
+        self.assertEqual((rotation.status, rotation.rows_rotated), (KeyRotation.RUNNING, 1))
+        self.assertEqual(self.decrypt_all(), self.plaintext)
+
+        rotation = rotate_rows(start_rotation(), batch_size=1)
+        self.assertEqual((rotation.status, rotation.rows_rotated), (KeyRotation.COMPLETE, 4))
+        self.assertEqual(self.decrypt_all(), self.plaintext)
+
+    def test_legacy_rows_are_loaded_once_per_batch(self):
+        for i in range(4):
+            store_password(self.users[0], f'Legacy{i}', legacy=True)
+        plaintext = self.decrypt_all()
+        rotation = start_rotation()
+
+        with CaptureQueriesContext(connection) as queries:
+            rotate_rows(rotation, batch_size=100)
+
+        row_reads = [query for query in queries if query['sql'].startswith('SELECT') and 'FROM "App_password"' in query['sql']]
+        self.assertEqual(len(row_reads), 2)
+        self.assertFalse(Password.objects.filter(decryption_key__isnull=False).exists())
+        self.assertEqual(self.decrypt_all(), plaintext)
+
+    def test_grace_period_waits_out_the_key_cache_without_a_shared_cache(self):
+        rotation = KeyRotation.objects.create(keys_rewrapped_at=timezone.now())
+        expected = settings.DATA_KEY_GENERATION_CHECK_INTERVAL if settings.REDIS_URL else settings.DATA_KEY_CACHE_TTL
+        self.assertAlmostEqual(rotation_module.grace_remaining(rotation), expected, delta=5)
+
+    def test_generation_bump_drops_data_keys_cached_by_other_processes(self):
+        user = self.users[0]
+        get_user_fernet(user.id)
+        with self.assertNumQueries(0):
+            get_user_fernet(user.id)
+
+        # Another worker rotating keys only reaches this one through the shared stamp.
+        cache.set(KEY_GENERATION_CACHE_KEY, cache.get(KEY_GENERATION_CACHE_KEY, 0) + 1, None)
+        with self.assertNumQueries(1):
+            get_user_fernet(user.id)
+
+
+class ExportTests(VaultTestCase):
+    def setUp(self):
+        self.entries = [self.create_entry('GitHub'), self.create_entry('GitLab')]
+
+    def assertArchive(self, content):
+        entries = read_archive(content.decode(), 'export passphrase')
+        self.assertEqual(sorted(entry['application_name'] for entry in entries), ['GitHub', 'GitLab'])
+
+    def test_export_streams_a_sync_iterator_under_wsgi(self):
+        response = self.client.post(
+            '/api/v1/dashboard/passwords/export/', {'passphrase': 'export passphrase'},
+            content_type='application/json', **self.headers(),
+        )
+        self.assertTrue(response.streaming)
+        self.assertFalse(response.is_async)
+        self.assertArchive(b''.join(response.streaming_content))
+
+    async def test_export_streams_an_async_iterator_under_asgi(self):
+        headers = {key[5:].replace('_', '-'): value for key, value in self.headers().items()}
+        with warnings.catch_warnings():
+            # Django warns, then buffers, when ASGI is handed a sync iterator.
+            warnings.simplefilter('error')
+            response = await self.async_client.post(
+                '/api/v1/dashboard/passwords/export/', {'passphrase': 'export passphrase'},
+                content_type='application/json', headers=headers,
+            )
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertArchive(content)
+
+    def export(self):
+        response = self.client.post(
+            '/api/v1/dashboard/passwords/export/', {'passphrase': 'export passphrase'},
+            content_type='application/json', **self.headers(),
+        )
+        return b''.join(response.streaming_content).decode()
+
+    def test_export_can_be_imported_again(self):
+        response = self.client.post('/api/v1/dashboard/passwords/', {
+            'application_name': 'Bank', 'site_url': 'https://bank.example.com',
+            'email_used': 'owner@example.com', 'username_used': 'owner',
+        }, content_type='application/json', **self.headers())
+        self.assertEqual(response.status_code, 201, response.content)
+
+        response = self.client.post(
+            '/api/v1/dashboard/passwords/import/', {'archive': self.export(), 'passphrase': 'export passphrase'},
+            content_type='application/json', **self.headers(),
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(response.json(), {'imported': 3})
+        self.assertEqual(Password.objects.filter(owner=self.user).count(), 6)
+
+    def test_archive_cannot_choose_its_kdf_cost(self):
+        header, *lines = self.export().splitlines()
+        header = json.loads(header)
+        for iterations in (2 ** 31, '480000', 0):
+            archive = '\n'.join([json.dumps({**header, 'iterations': iterations}), *lines])
+            with mock.patch('App.archive.archive_fernet') as derive:
+                with self.assertRaisesMessage(ArchiveError, 'Unsupported archive key derivation settings.'):
+                    read_archive(archive, 'export passphrase')
+            derive.assert_not_called()
+
+
+class BreachFilterTests(VaultTestCase):
+    BREACHED = ['Tr0ub4dor&3x', 'hunter2hunter2', 'qwerty', 'letmein']
+
+    def setUp(self):
+        _buckets.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'breach.bloom')
+        digests = [hashlib.sha1(password.encode()).digest() for password in self.BREACHED]
+        self.assertEqual(build_filter(self.path, lambda: iter(digests), shard_bits=2), len(digests))
+        self.use_filter(self.path)
+
+    def use_filter(self, path):
+        self.forget_filter()
+        self.addCleanup(self.forget_filter)
+        override = override_settings(BREACH_FILTER_PATH=path)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def forget_filter(self):
+        if breach_module._filter:
+            breach_module._filter.close()
+        breach_module._filter = None
+
+    def test_build_filter_writes_one_shard_per_prefix(self):
+        breach_filter = BreachFilter(self.path)
+        self.addCleanup(breach_filter.close)
+        self.assertEqual(breach_filter.shard_bits, 2)
+        self.assertEqual(breach_filter.hash_count, 10)
+        self.assertEqual(len(breach_filter.shards), 4)
+        self.assertEqual(sum(1 for _, size in breach_filter.shards if size), len({hashlib.sha1(p.encode()).digest()[0] >> 6 for p in self.BREACHED}))
+
+    def test_lookups(self):
+        breach_filter = get_breach_filter()
+        for password in self.BREACHED:
+            self.assertIn(password, breach_filter)
+        self.assertNotIn('correct horse battery', breach_filter)
+        self.assertNotIn('Password', breach_filter)
+
+    def test_unreadable_filter_is_logged_and_disabled(self):
+        with open(self.path, 'r+b') as f:
+            f.write(b'NOTBLOOM')
+        self.use_filter(self.path)
+        with self.assertLogs('App.breach', 'WARNING') as logs:
+            self.assertIsNone(get_breach_filter())
+        self.assertIn('is not a breach filter', logs.output[0])
+
+        self.use_filter(self.path + '.missing')
+        with self.assertLogs('App.breach', 'WARNING'):
+            self.assertIsNone(get_breach_filter())
+
+    def test_register_rejects_breached_password(self):
+        def register(password):
+            return self.client.post('/api/v1/accounts/user/', {'email': 'new@example.com', 'password': password}, content_type='application/json', HTTP_X_API_KEY=self.api_key)
+
+        response = register('hunter2hunter2')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'password': ['This password has appeared in a data breach. Please choose a different one.']})
+        self.assertFalse(CustomUser.objects.filter(email='new@example.com').exists())
+        self.assertEqual(register('a long passphrase').status_code, 201)
+
+    def test_reset_rejects_breached_password(self):
+        def confirm(password):
+            body = {'email': self.user.email, 'verification_code': code, 'new_password': password}
+            return self.client.post('/api/v1/accounts/confirm-password-reset/', body, content_type='application/json', HTTP_X_API_KEY=self.api_key)
+
+        code = get_code_store().issue(RESET, self.user)
+        response = confirm('Tr0ub4dor&3x')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'new_password': ['This password has appeared in a data breach. Please choose a different one.']})
+        self.assertEqual(confirm('a long passphrase').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('a long passphrase'))
+
+
+class AsyncAccountViewTests(VaultTestCase):
+    def setUp(self):
+        _buckets.clear()
+
+    def post(self, path, data, api_key=True):
+        headers = {'X-API-Key': self.api_key} if api_key else {}
+        return self.async_client.post(f'/api/v1/async/{path}', data, content_type='application/json', headers=headers)
+
+    async def test_register_creates_user_and_queues_verification_email(self):
+        response = await self.post('accounts/user/', {'email': 'new@example.com', 'password': 'a long passphrase'})
+        self.assertEqual(response.status_code, 201, response.content)
+        user = await CustomUser.objects.aget(email='new@example.com')
+        self.assertFalse(user.is_verified)
+        self.assertTrue(await OutboundEmail.objects.filter(recipient='new@example.com', template='verification_email.html').aexists())
+
+    async def test_register_rejects_taken_email_and_missing_api_key(self):
+        response = await self.post('accounts/user/', {'email': 'owner@example.com', 'password': 'a long passphrase'})
+        self.assertEqual(response.status_code, 400)
+        response = await self.post('accounts/user/', {'email': 'new@example.com', 'password': 'a long passphrase'}, api_key=False)
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(await CustomUser.objects.filter(email='new@example.com').aexists())
+
+    async def test_login(self):
+        response = await self.post('accounts/login/', {'email': 'owner@example.com', 'password': 'correct horse battery'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['user'], str(self.user.id))
+        self.assertTrue(response.json()['token'])
+
+        response = await self.post('accounts/login/', {'email': 'owner@example.com', 'password': 'wrong password'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_login_requires_verified_account(self):
+        await CustomUser.objects.filter(pk=self.user.pk).aupdate(is_verified=False)
+        response = await self.post('accounts/login/', {'email': 'owner@example.com', 'password': 'correct horse battery'})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_reset_password_queues_reset_code(self):
+        response = await self.post('accounts/reset-password/', {'email': 'owner@example.com'})
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(await OutboundEmail.objects.filter(recipient='owner@example.com', template='reset_code_email.html').aexists())
+
+        response = await self.post('accounts/reset-password/', {'email': 'nobody@example.com'})
+        self.assertEqual(response.status_code, 404)
+
+
+class LoginTests(VaultTestCase):
+    def setUp(self):
+        _buckets.clear()
+
+    def login(self, **headers):
+        body = {'email': 'owner@example.com', 'password': 'correct horse battery'}
+        return self.client.post('/api/v1/accounts/login/', body, content_type='application/json', HTTP_X_API_KEY=self.api_key, **headers)
+
+    def saturated_pool(self):
+        pool = HashingPool(workers=1, max_pending=1)
+        release = threading.Event()
+        pool.submit(release.wait)
+        self.addCleanup(pool.executor.shutdown)
+        self.addCleanup(release.set)
+        return pool
+
+    def test_pool_rejects_work_once_every_slot_is_taken(self):
+        pool = HashingPool(workers=1, max_pending=1)
+        self.addCleanup(pool.executor.shutdown)
+        release = threading.Event()
+        future = pool.submit(release.wait)
+        with self.assertRaises(HashingPoolSaturated):
+            pool.submit(release.wait)
+        release.set()
+        future.result()
+        self.assertTrue(pool.submit(lambda: True).result(timeout=5))
+
+    @override_settings(LOGIN_RETRY_AFTER=3)
+    def test_saturated_pool_returns_503_with_retry_after(self):
+        with mock.patch('App.hashing._pool', self.saturated_pool()):
+            response = self.login()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+        self.assertEqual(self.login().status_code, 200)
+
+    @override_settings(LOGIN_RETRY_AFTER=3)
+    async def test_async_saturated_pool_returns_503_with_retry_after(self):
+        with mock.patch('App.hashing._pool', self.saturated_pool()):
+            response = await self.async_client.post(
+                '/api/v1/async/accounts/login/', {'email': 'owner@example.com', 'password': 'correct horse battery'},
+                content_type='application/json', headers={'X-API-Key': self.api_key},
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '3')
+
+    def test_login_creates_a_session_by_default(self):
+        response = self.login()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    @override_settings(LOGIN_CREATE_SESSION=False)
+    def test_stateless_login_skips_the_session_write(self):
+        with mock.patch('django.contrib.sessions.backends.base.SessionBase.save') as save:
+            response = self.login()
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(response.json()['token'])
+        save.assert_not_called()
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+
+    def test_stateless_login_header_skips_the_session_write(self):
+        response = self.login(HTTP_X_STATELESS_LOGIN='true')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+
+class SendCodeThrottleTests(VaultTestCase):
+    def setUp(self):
+        _buckets.clear()
+
+    def resend(self, api_key, path='resend-verification-code/'):
+        return self.client.post(f'/api/v1/{path}', {'email': self.user.email}, content_type='application/json', HTTP_X_API_KEY=api_key)
+
+    def test_resend_requires_a_valid_api_key(self):
+        for path in ('resend-verification-code/', 'resend-reset-code/'):
+            self.assertEqual(self.resend(str(uuid.uuid4()), path).status_code, 401)
+            self.assertEqual(self.client.post(f'/api/v1/{path}', {'email': self.user.email}, content_type='application/json').status_code, 401)
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_spellings_of_one_key_share_a_bucket(self):
+        key = uuid.UUID(self.api_key)
+        spellings = [str(key), str(key).upper(), f'{{{key}}}', key.hex, f'urn:uuid:{key}']
+        for api_key in spellings:
+            self.assertEqual(self.resend(api_key).status_code, 201)
+        self.assertEqual(self.resend(str(key).upper()).status_code, 429)
+
+    async def test_async_resend_requires_a_valid_api_key(self):
+        for path in ('resend-verification-code/', 'resend-reset-code/'):
+            response = await self.async_client.post(f'/api/v1/async/{path}', {'email': self.user.email}, content_type='application/json')
+            self.assertEqual(response.status_code, 401)
+        self.assertFalse(await OutboundEmail.objects.aexists())
+
+
+class AccountThrottleTests(VaultTestCase):
+    def setUp(self):
+        _buckets.clear()
+
+    def post(self, path, data):
+        return self.client.post(f'/api/v1/accounts/{path}', data, content_type='application/json', HTTP_X_API_KEY=self.api_key)
+
+    def assertThrottled(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+
+    def test_login_is_throttled_per_account(self):
+        for _ in range(10):
+            self.assertEqual(self.post('login/', {'email': 'owner@example.com', 'password': 'wrong password'}).status_code, 401)
+        self.assertThrottled(self.post('login/', {'email': 'OWNER@example.com', 'password': 'correct horse battery'}))
+        self.assertEqual(self.post('login/', {'email': 'other@example.com', 'password': 'wrong password'}).status_code, 401)
+
+    def test_confirm_code_is_throttled_per_user(self):
+        self.user.is_verified = False
+        self.user.save()
+        path = f'user/{self.user.id}/confirm-code/'
+        for _ in range(10):
+            self.assertEqual(self.post(path, {'verification_code': 'wrong'}).status_code, 400)
+        code = get_code_store().issue(VERIFICATION, self.user)
+        self.assertThrottled(self.post(path, {'verification_code': code}))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_verified)
+
+    def test_password_reset_confirmation_is_throttled_per_account(self):
+        body = {'email': self.user.email, 'verification_code': 'wrong', 'new_password': 'a long passphrase'}
+        for _ in range(10):
+            self.assertEqual(self.post('confirm-password-reset/', body).status_code, 400)
+        self.assertThrottled(self.post('confirm-password-reset/', {**body, 'verification_code': get_code_store().issue(RESET, self.user)}))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('correct horse battery'))
+
+
+@skipUnless(settings.DATABASES['default']['ENGINE'] == 'Manager.db_pool', 'Runs against PostgreSQL with DATABASE_POOL=True.')
+class ConnectionPoolTests(SimpleTestCase):
+    databases = {'default'}
+
+    def backend_pid(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_backend_pid()')
+            return cursor.fetchone()[0]
+
+    def test_closed_connections_go_back_to_the_pool(self):
+        connection.ensure_connection()
+        pool = connection.pool
+        connection.close()
+        opened = pool.get_stats()['connections_num']
+
+        pids = set()
+        for _ in range(5):
+            pids.add(self.backend_pid())
+            connection.close()
+
+        self.assertEqual(pool.get_stats()['connections_num'], opened)
+        self.assertLessEqual(len(pids), pool.max_size)
+
+    def test_broken_connections_are_replaced(self):
+        pid = self.backend_pid()
+        connection.close()
+        with psycopg.connect(**connection.get_connection_params(), autocommit=True) as admin:
+            admin.execute('SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()')
+
+        self.assertNotEqual(self.backend_pid(), pid)
+        connection.close()
+
+
+@skipUnless(replica_aliases(), 'Set DATABASE_REPLICA_URLS (e.g. to DATABASE_URL) to run the replica routing tests.')
+class ReplicaRoutingTests(TransactionTestCase):
+    """TestCase's wrapping transaction would hide rows from the replica connection
+    and keep the router on the primary, so these tests commit for real."""
+    databases = {'default', *replica_aliases()}
+
+    def setUp(self):
+        api_user = ApiUser.objects.create(email='client@example.com', first_name='Test', last_name='Client')
+        self.api_key = str(APIKey.objects.create(owner=api_user).api_key)
+        self.user = CustomUser.objects.create_user(email='owner@example.com', password='correct horse battery')
+        self.entry = store_password(self.user, 'GitHub')
+        tokens = start_request()
+        self.addCleanup(end_request, tokens)
+
+    def headers(self):
+        return {'HTTP_X_API_KEY': self.api_key, 'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    @contextmanager
+    def record_queries(self):
+        """Yield a list of ('default' or 'replica', sql) for every query, in the order they ran."""
+        log = []
+        def recorder(alias):
+            def execute(run, sql, params, many, context):
+                log.append((alias, sql))
+                return run(sql, params, many, context)
+            return execute
+        with ExitStack() as stack:
+            for alias in self.databases:
+                stack.enter_context(connections[alias].execute_wrapper(recorder('replica' if alias in replica_aliases() else alias)))
+            yield log
+
+    def test_safe_reads_go_to_the_replica(self):
+        with self.record_queries() as log:
+            listing = self.client.get('/api/v1/dashboard/passwords/', **self.headers())
+            detail = self.client.get(f'/api/v1/dashboard/passwords/{self.entry.id}/', **self.headers())
+        self.assertEqual((listing.status_code, detail.status_code), (200, 200))
+        password_reads = {alias for alias, sql in log if 'FROM "App_password"' in sql}
+        self.assertEqual(password_reads, {'replica'})
+        self.assertIn(ReplicaRouter().db_for_read(Password), replica_aliases())
+
+    def test_writes_and_use_primary_go_to_default(self):
+        with self.record_queries() as log:
+            with use_primary():
+                list(Password.objects.all())
+            store_password(self.user, 'GitLab')
+        self.assertTrue(log)
+        self.assertEqual({alias for alias, _ in log}, {'default'})
+
+    def test_reads_after_a_write_in_one_request_stay_on_the_primary(self):
+        with self.record_queries() as log:
+            list(Password.objects.filter(owner=self.user))
+            self.entry.set_encrypted({'application_name': 'Gitea'})
+            self.entry.save()
+            list(Password.objects.filter(owner=self.user))
+        self.assertEqual([alias for alias, sql in log if 'FROM "App_password"' in sql], ['replica', 'default'])
+
+        # The middleware starts the next request unpinned.
+        with self.record_queries() as log:
+            response = self.client.get(f'/api/v1/dashboard/passwords/{self.entry.id}/', **self.headers())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({alias for alias, sql in log if 'FROM "App_password"' in sql}, {'replica'})
+
+
+    def test_unavailable_replicas_are_logged_and_skipped(self):
+        self.addCleanup(_unhealthy_until.clear)
+        with ExitStack() as stack:
+            for alias in replica_aliases():
+                stack.enter_context(mock.patch.object(connections[alias], 'ensure_connection', side_effect=DatabaseError('connection refused')))
+            with self.assertLogs('App.routers', 'WARNING') as logs:
+                self.assertEqual(ReplicaRouter().db_for_read(Password), 'default')
+        self.assertEqual(len(logs.output), len(replica_aliases()))
+        self.assertIn('is unavailable, reading from the primary: connection refused', logs.output[0])
+
+    def test_data_keys_are_read_from_the_primary(self):
+        forget_data_keys()
+        with self.record_queries() as log:
+            get_user_fernet(self.user.id)
+        key_reads = [alias for alias, sql in log if '"wrapped_key"' in sql]
+        self.assertTrue(key_reads)
+        self.assertEqual(set(key_reads), {'default'})
+
+class CodeStoreContract:
+    """Behaviour every CodeStore has, mixed into one TestCase per store."""
+    store_class = None
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='coder@example.com', password='unused')
+        with self.settings(CODE_MAX_ATTEMPTS=3):
+            self.store = self.store_class()
+
+    def expire_codes(self):
+        raise NotImplementedError
+
+    def test_issued_code_verifies_once(self):
+        code = self.store.issue(VERIFICATION, self.user)
+        self.assertRegex(code, r'^\d{6}$')
+        self.assertTrue(self.store.verify(VERIFICATION, self.user, code))
+        self.assertFalse(self.store.verify(VERIFICATION, self.user, code))
+
+    def test_codes_are_per_purpose_and_replaced_when_reissued(self):
+        old = self.store.issue(VERIFICATION, self.user)
+        reset = self.store.issue(RESET, self.user)
+        new = self.store.issue(VERIFICATION, self.user)
+        if old != new:
+            self.assertFalse(self.store.verify(VERIFICATION, self.user, old))
+        self.assertTrue(self.store.verify(VERIFICATION, self.user, new))
+        self.assertTrue(self.store.verify(RESET, self.user, reset))
+
+    def test_code_is_dropped_after_max_attempts(self):
+        code = self.store.issue(RESET, self.user)
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(3):
+            self.assertFalse(self.store.verify(RESET, self.user, wrong))
+        self.assertFalse(self.store.verify(RESET, self.user, code))
+
+        code = self.store.issue(RESET, self.user)
+        self.assertTrue(self.store.verify(RESET, self.user, code))
+
+    def test_expired_code_is_rejected(self):
+        with self.settings(CODE_TTL=1):
+            store = self.store_class()
+        code = store.issue(VERIFICATION, self.user)
+        self.expire_codes()
+        self.assertFalse(store.verify(VERIFICATION, self.user, code))
+
+
+LOCMEM_CODE_CACHE = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'codes'}
+REDIS_CODE_CACHE = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': settings.REDIS_URL}
+
+
+@override_settings(CACHES={**settings.CACHES, 'codes': LOCMEM_CODE_CACHE}, CODE_STORE_CACHE_ALIAS='codes')
+class LocMemCacheCodeStoreTests(CodeStoreContract, TestCase):
+    store_class = CacheCodeStore
+
+    def expire_codes(self):
+        time.sleep(1.1)
+
+
+@skipUnless(settings.REDIS_URL, 'Set REDIS_URL to run the Redis code store tests.')
+@override_settings(CACHES={**settings.CACHES, 'codes': REDIS_CODE_CACHE}, CODE_STORE_CACHE_ALIAS='codes')
+class RedisCacheCodeStoreTests(CodeStoreContract, TestCase):
+    store_class = CacheCodeStore
+
+    def expire_codes(self):
+        time.sleep(1.1)
+
+
+class DatabaseCodeStoreTests(CodeStoreContract, TestCase):
+    store_class = DatabaseCodeStore
+
+    def expire_codes(self):
+        for model in (VerificationCode, PasswordResetCode):
+            model.objects.update(created_at=timezone.now() - timedelta(seconds=2))
+
+
+class CodePurgeTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='coder@example.com', password='unused')
+
+    def code(self, model, age):
+        code = model.create(self.user)
+        model.objects.filter(pk=code.pk).update(created_at=timezone.now() - timedelta(seconds=age))
+        return code
+
+    @override_settings(CODE_TTL=600)
+    def test_purge_uses_the_code_ttl(self):
+        for model in (VerificationCode, PasswordResetCode):
+            kept, expired = self.code(model, 400), self.code(model, 700)
+            self.assertEqual(model.delete_expired_codes(batch_size=1), 1)
+            self.assertEqual(list(model.objects.values_list('pk', flat=True)), [kept.pk])
+
+    def test_command_purges_without_scheduling_a_second_task(self):
+        self.code(VerificationCode, settings.CODE_TTL + 60)
+        out = StringIO()
+        call_command('delete_codes', stdout=out)
+        self.assertIn('VerificationCode: 1 rows', out.getvalue())
+        self.assertFalse(VerificationCode.objects.exists())
+        self.assertFalse(PeriodicTask.objects.filter(name='purge-expired-codes').exists())
+        self.assertEqual(settings.CELERY_BEAT_SCHEDULE['purge-expired-codes']['task'], 'App.tasks.purge_expired_codes')
@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .crypto import keyed_digest
+
+#pylint: disable=no-member
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'5/hour' -> (5, 3600), in the same format as DRF's throttle rates."""
+    if rate is None:
+        return None
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class TokenBuckets:
+    """In-process token buckets, refilled continuously at capacity/period tokens a second.
+
+    The least recently used buckets are dropped past maxsize.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def consume(self, key, capacity, period, now):
+        """Take a token from key's bucket; return 0 if one was there, else the seconds until one is."""
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * capacity / period)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) * period / capacity
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.maxsize:
+                self.buckets.popitem(last=False)
+            return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+_buckets = TokenBuckets(settings.THROTTLE_BUCKETS_SIZE)
+
+
+def _consume_shared(cache, key, capacity, period, now):
+    # A shared cache only offers atomic increments, so processes share a
+    # counter per period window rather than a continuously refilled bucket.
+    window = int(now // period)
+    cache_key = f'throttle:{keyed_digest(key, window)}'
+    cache.add(cache_key, 0, period)
+    try:
+        count = cache.incr(cache_key)
+    except ValueError:
+        cache.set(cache_key, 1, period)
+        count = 1
+    if count <= capacity:
+        return 0.0
+    return (window + 1) * period - now
+
+
+def consume(scope, identities):
+    """Charge one request to each identity's bucket under scope; return the longest wait, 0 if allowed."""
+    rates = api_settings.DEFAULT_THROTTLE_RATES
+    now = time.time()
+    wait = 0.0
+    for kind, identity in identities:
+        rate = parse_rate(rates.get(f'{scope}-{kind}', rates.get(scope)))
+        if rate is None or identity is None:
+            continue
+        key = (scope, kind, identity)
+        if settings.THROTTLE_CACHE_ALIAS:
+            wait = max(wait, _consume_shared(caches[settings.THROTTLE_CACHE_ALIAS], key, *rate, now))
+        else:
+            wait = max(wait, _buckets.consume(key, *rate, now))
+    return wait
+
+
+def request_identities(request, account, ident):
+    """Buckets are per validated API client, split by account (an email or user id) and by client IP.
+
+    The client comes from APIKeyPermission (or api_key_required), never from
+    the raw header, so sending made-up keys cannot open fresh buckets.
+    """
+    api_user = getattr(request, 'api_user', None)
+    client = api_user.pk if api_user is not None else None
+    return [
+        ('account', f'{client}:{str(account).strip().lower()}' if account else None),
+        ('ip', f'{client}:{ident}'),
+    ]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Token-bucket throttle for views that set throttle_scope.
+
+    Rates come from REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], keyed
+    '<scope>-account' or '<scope>-ip', falling back to '<scope>'.
+    """
+    def allow_request(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if not scope:
+            return True
+        data = request.data if hasattr(request.data, 'get') else {}
+        account = data.get('email') or view.kwargs.get('user_id')
+        self.retry_after = consume(scope, request_identities(request, account, self.get_ident(request)))
+        return not self.retry_after
+
+    def wait(self):
+        return self.retry_after
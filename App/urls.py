@@ -1,7 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import UserViewset, LoginViewset, LogoutViewset, PasswordViewset, APIUserViewset, PasswordResetView, PasswordConfirmView, QuickTipViewset, ResendVerificationCode, ResendPasswordResetCode
+from . import async_views
+from .views import UserViewset, LoginViewset, LogoutViewset, PasswordViewset, APIUserViewset, PasswordResetView, PasswordConfirmView, QuickTipViewset, ResendVerificationCode, ResendPasswordResetCode, MetricsView
 
 router = DefaultRouter()
 router.register(r'accounts/api-user', APIUserViewset, basename='register api user')
@@ -20,4 +21,11 @@ urlpatterns = [
     path('accounts/reset-password/', PasswordResetView.as_view(), name='Reset password'),
     path('accounts/confirm-password-reset/', PasswordConfirmView.as_view(), name='Confirm password reset'),
     path('dashboard/quick-tips/', QuickTipViewset.as_view(), name='Quick Tips'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('async/accounts/user/', async_views.register, name='async register user'),
+    path('async/accounts/login/', async_views.login, name='async login'),
+    path('async/accounts/reset-password/', async_views.reset_password, name='async reset password'),
+    path('async/resend-verification-code/', async_views.resend_verification_code, name='async resend verification code'),
+    path('async/resend-reset-code/', async_views.resend_reset_code, name='async resend reset code'),
+    path('async/dashboard/quick-tips/', async_views.quick_tips, name='async quick tips'),
 ]
\ No newline at end of file
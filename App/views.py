@@ -1,61 +1,57 @@
-import random
-import string
 from rest_framework.response import Response
 from rest_framework import status, viewsets
-from django.contrib.auth import login, authenticate, logout
+from django.contrib.auth import logout
 from rest_framework.views import APIView
 from rest_framework.decorators import action
-from cryptography.fernet import Fernet
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework_simplejwt.tokens import AccessToken
 from django.shortcuts import get_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from django.db import transaction
+from django.utils import timezone
 
 
-from .models import CustomUser, Password, ApiUser, VerificationCode, PasswordResetCode, QuickTip
-from .serializers import UserSerializer, LoginSerializer, PasswordSerializer, APIUserSerializer, PasswordResetSerializer, PasswordConfirmSerializer, ResendCodeSerializer
+from .models import CustomUser, Password, PasswordSearchToken, PasswordTombstone, ApiUser, QuickTip
+from .serializers import UserSerializer, LoginSerializer, PasswordSerializer, APIUserSerializer, PasswordResetSerializer, PasswordConfirmSerializer, ResendCodeSerializer, PasswordRowSerializer, _datetime
 from .permissions import APIKeyPermission
-from .filters import MyDjangoFilter
+from .authentication import CachedJWTAuthentication
+from .filters import MyDjangoFilter, BlindIndexFilter
+from .pagination import PasswordPagination
+from .renderers import VaultJSONRenderer
+from .search import SEARCHABLE_FIELDS, index_password, build_search_tokens, fuzzy_search
+from .archive import export_archive, aexport_archive, read_archive, ArchiveError
+from .domains import domain_digest, host_of
+from .crypto import keyed_digest
+from .health import health_report
+from .routers import replica_aliases, pin_primary, use_primary
+from .mail import queue_email
+from .codes import get_code_store, VERIFICATION, RESET
+from .throttling import TokenBucketThrottle
+from .hashing import verify_credentials, record_login, HashingPoolSaturated
+from . import metrics
 from django.conf import settings
 
 
 #pylint: disable=no-member
 def send_verification_code(request, user):
-    VerificationCode.objects.filter(user=user).delete()
+    verification_code = get_code_store().issue(VERIFICATION, user)
     
-    verification_code = ''.join(random.choices(string.digits, k=6))
-    
-    VerificationCode.objects.create(user=user, code=verification_code)
-    
-    subject = "Account Verification Code"
-    sender_name = 'The Two Devs Team'
-    sender_email = settings.EMAIL_HOST_USER
-    recipient_email = user.email
-
-    html_message = render_to_string('verification_email.html', {
-        'verification_code': verification_code,
-        'sender_name': sender_name,
-    })
-
-    plain_message = strip_tags(html_message)
-
-    try:
-        send_mail(
-            subject,
-            plain_message,
-            f"{sender_name} <{sender_email}>",
-            [recipient_email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-    except Exception as e:
-        print(f"Error sending email: {e}")
+    queue_email(
+        "Account Verification Code",
+        'verification_email.html',
+        {'verification_code': verification_code},
+        user.email,
+    )
     
 
 class ResendVerificationCode(APIView):
     serializer_class = ResendCodeSerializer
+    permission_classes = [APIKeyPermission]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'send-code'
     
     def post(self, request):
         email = request.data.get('email', None)
@@ -74,39 +70,21 @@ class ResendVerificationCode(APIView):
 
 
 def send_reset_code(request, user):
-    PasswordResetCode.objects.filter(user=user).delete()
-    
-    verification_code = ''.join(random.choices(string.digits, k=6))
-    
-    PasswordResetCode.objects.create(user=user, code=verification_code)
+    verification_code = get_code_store().issue(RESET, user)
     
-    subject = "Password Reset Code"
-    sender_name = 'The Two Devs Team'
-    sender_email = settings.EMAIL_HOST_USER
-    recipient_email = user.email
-
-    html_message = render_to_string('reset_code_email.html', {
-        'verification_code': verification_code,
-        'sender_name': sender_name,
-    })
-
-    plain_message = strip_tags(html_message)
-
-    try:
-        send_mail(
-            subject,
-            plain_message,
-            f"{sender_name} <{sender_email}>",
-            [recipient_email],
-            html_message=html_message,
-            fail_silently=False,
-        )
-    except Exception as e:
-        print(f"Error sending email: {e}")
+    queue_email(
+        "Password Reset Code",
+        'reset_code_email.html',
+        {'verification_code': verification_code},
+        user.email,
+    )
         
 
 class ResendPasswordResetCode(APIView):
     serializer_class = ResendCodeSerializer
+    permission_classes = [APIKeyPermission]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'send-code'
     
     def post(self, request):
         email = request.data.get('email', None)
@@ -127,6 +105,11 @@ class UserViewset(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [APIKeyPermission]
     filter_backends = [MyDjangoFilter]
+    throttle_classes = [TokenBucketThrottle]
+    
+    @property
+    def throttle_scope(self):
+        return 'confirm-code' if self.action == 'confirm_code' else None
     
     @action(methods=['POST'], detail=False)
     def register(self, request):
@@ -155,12 +138,9 @@ class UserViewset(viewsets.ModelViewSet):
         code = request.data.get('verification_code')
         user = get_object_or_404(CustomUser, id=user_id)
         
-        verification_code = VerificationCode.objects.filter(user=user).first()
-        
-        if verification_code and verification_code.code == code:
+        if code and get_code_store().verify(VERIFICATION, user, code):
             user.is_verified = True
             user.save()
-            verification_code.delete()
             return Response({'message': 'Email verified & account activated.'}, status=status.HTTP_200_OK)
         else:
             return Response({'error': 'Invalid verification code.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -228,6 +208,8 @@ class APIUserViewset(viewsets.ModelViewSet):
 class LoginViewset(APIView):
     serializer_class = LoginSerializer
     permission_classes = [APIKeyPermission]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'login'
 
     @action(detail=False, methods=['POST'])
     def post(self, request):
@@ -236,13 +218,19 @@ class LoginViewset(APIView):
         email = serializer.validated_data['email']
         password = serializer.validated_data['password']
         
-        user = authenticate(request, email=email, password=password)
+        try:
+            user = verify_credentials(email, password)
+        except HashingPoolSaturated:
+            return Response(
+                {'error': 'Too many login attempts in progress, please retry shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(settings.LOGIN_RETRY_AFTER)},
+            )
         
         if user is not None:
             if user.is_verified == True:
-                login(request, user)
-                refresh = RefreshToken.for_user(user)
-                token = str(refresh.access_token)
+                record_login(request, user)
+                token = str(AccessToken.for_user(user))
                 return Response({'token': token, 'user': user.id}, status=status.HTTP_200_OK)
             elif user.is_verified == False:
                 return Response({'error': 'Your account needs to be verified to proceed.'}, status=status.HTTP_400_BAD_REQUEST)
@@ -252,83 +240,288 @@ class LoginViewset(APIView):
 
 class LogoutViewset(APIView):
     permission_classes = [APIKeyPermission]
-    authentication_classes = [JWTAuthentication]
+    authentication_classes = [CachedJWTAuthentication]
     
     @action(detail=False, methods=['POST'])
     def post(self, request):
         logout(request)
         return Response({'message': 'User logged out successfully.'}, status=status.HTTP_200_OK)
 
+def etag_matches(request, etag):
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    return etag in if_none_match or '*' in if_none_match
+
+
+def refresh_vault_revision(user):
+    """Reload user.vault_revision from the primary.
+    
+    request.user can come from a per-process cache that predates writes made
+    through other workers, so the revision is reloaded before it is used for
+    ETags, replica checks or the fuzzy index.
+    """
+    with use_primary():
+        user.vault_revision = CustomUser.objects.filter(pk=user.id).values_list('vault_revision', flat=True).get()
+    return user.vault_revision
+
+
+def read_your_writes(user):
+    """Pin the request to the primary while the replica lags behind user.vault_revision, which must be fresh."""
+    if replica_aliases() and not CustomUser.objects.filter(pk=user.id, vault_revision__gte=user.vault_revision).exists():
+        pin_primary()
+
+
 class PasswordViewset(viewsets.ModelViewSet):
     queryset = Password.objects.all()
     serializer_class = PasswordSerializer
     permission_classes = [APIKeyPermission]
-    authentication_classes = [JWTAuthentication]
-    filter_backends = [MyDjangoFilter]
-    search_fields = ['application_name', 'site_url', 'email_used', 'username_used']
+    authentication_classes = [CachedJWTAuthentication]
+    filter_backends = [BlindIndexFilter]
+    pagination_class = PasswordPagination
+    search_fields = SEARCHABLE_FIELDS
+    list_decrypted_fields = ['application_name']
+    renderer_classes = [VaultJSONRenderer, BrowsableAPIRenderer]
+    import_batch_size = 500
 
     def perform_create(self, serializer):
-        serializer.save(owner=self.request.user)
-        self._encrypt_password(serializer.instance)
+        # The row and its search tokens are written together or not at all.
+        with transaction.atomic():
+            serializer.save(owner=self.request.user)
+            index_password(serializer.instance, serializer.validated_data, replace=False)
 
     def perform_update(self, serializer):
         instance = serializer.instance
-        self._encrypt_password(instance, serializer.validated_data)
-        super().perform_update(serializer)
-
-    def _encrypt_password(self, instance, data=None):
-        fernet_key = instance.decryption_key
-        encrypted_data = self._encrypt_data(data or instance.__dict__, fernet_key)
-        for key, value in encrypted_data.items():
-            setattr(instance, key, value)
-        instance.save()
-
-    def _encrypt_data(self, data, fernet_key):
-        encrypted_data = {}
-        fernet = Fernet(fernet_key)
-        for key, value in data.items():
-            if isinstance(value, str):
-                encrypted_value = fernet.encrypt(value.encode()).decode()
-                encrypted_data[key] = encrypted_value
-        return encrypted_data
-
-    def _decrypt_data(self, instance, fernet_key):
-        fernet = Fernet(fernet_key)
-        decrypted_data = {}
-        for key, value in instance.__dict__.items():
-            if isinstance(value, str):
-                decrypted_value = fernet.decrypt(value.encode()).decode()
-                decrypted_data[key] = decrypted_value
-        return decrypted_data
+        missing_fields = [field for field in SEARCHABLE_FIELDS if field not in serializer.validated_data]
+        plaintext = {**instance.decrypted(missing_fields), **serializer.validated_data}
+        with transaction.atomic():
+            serializer.save()
+            index_password(instance, plaintext)
 
     def retrieve(self, request, *args, **kwargs):
+        if replica_aliases():
+            refresh_vault_revision(request.user)
+            read_your_writes(request.user)
         instance = self.get_object()
-        if instance.owner != request.user:
+        if instance.owner_id != request.user.id:
             return Response({"error": "You are not authorized to view this password."}, status=status.HTTP_403_FORBIDDEN)
 
-        fernet_key = instance.decryption_key
-        if not fernet_key:
-            return Response({"error": "Decryption key not found."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        decrypted_data = self._decrypt_data(instance, fernet_key)
-        return Response(decrypted_data)
+        fields = self.requested_fields()
+        etag = quote_etag(':'.join([str(instance.id), str(instance.version), *(fields or [])]))
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        
+        if fields:
+            decrypted = instance.decrypted([field for field in fields if field in Password.ENCRYPTED_FIELDS])
+            response = Response(PasswordRowSerializer(fields).to_representation(instance, decrypted))
+        else:
+            response = Response({**instance.decrypted(), 'version': instance.version, 'breached': instance.breached})
+        response['ETag'] = etag
+        return response
+    
+    def list(self, request, *args, **kwargs):
+        # The vault revision moves on every write, so it stands in for the
+        # contents of any listing without touching the entries.
+        etag = quote_etag(keyed_digest(request.user.id, refresh_vault_revision(request.user), request.get_full_path()))
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
+        
+        read_your_writes(request.user)
+        response = self._list(request)
+        response['ETag'] = etag
+        return response
+    
+    def _list(self, request):
+        if 'since' in request.query_params:
+            return self._changes(request)
+        
+        search_param = request.query_params.get('search', '').strip()
+        if search_param and request.query_params.get('fuzzy', '').lower() in ('1', 'true'):
+            return self._fuzzy_list(request, search_param)
+        
+        fields = self.requested_fields()
+        queryset = self.filter_queryset(self.sparse(self.get_queryset(), fields))
+        
+        page = self.paginate_queryset(queryset)
+        entries = page if page is not None else list(queryset)
+        
+        if fields:
+            decrypted_fields = [field for field in fields if field in Password.ENCRYPTED_FIELDS]
+        else:
+            decrypted_fields = self.list_decrypted_fields
+        data = PasswordRowSerializer(fields).many(entries, Password.decrypt_many(entries, decrypted_fields))
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+    
+    def _changes(self, request):
+        try:
+            since = int(request.query_params['since'])
+        except ValueError:
+            return Response({'error': 'since must be a cursor returned by a previous sync.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        latest, purged = CustomUser.objects.filter(pk=request.user.id).values_list('vault_revision', 'purged_revision').get()
+        if 0 < since < purged:
+            return Response({'error': 'This cursor is older than the kept deletions; sync again from since=0.'}, status=status.HTTP_410_GONE)
+        
+        # Every change has its own revision, so a page ends exactly where the
+        # next one starts.
+        fields = self.requested_fields()
+        queryset = self.sparse(self.get_queryset(), fields)
+        limit = self.paginator.get_page_size(request)
+        window = {'revision__gt': since, 'revision__lte': latest}
+        instances = list(queryset.filter(**window).order_by('revision')[:limit + 1])
+        tombstones = list(PasswordTombstone.objects.filter(owner=request.user, **window).order_by('revision').values_list('revision', 'id')[:limit + 1])
+        entries = sorted([(instance.revision, instance) for instance in instances] + tombstones, key=lambda entry: entry[0])
+        has_more = len(entries) > limit
+        if has_more:
+            # Imports from before revisions were reserved per row share one
+            # revision, which must not be split across pages.
+            boundary = entries[limit][0]
+            entries = [entry for entry in entries[:limit] if entry[0] < boundary] or [
+                (boundary, instance) for instance in queryset.filter(revision=boundary)
+            ]
+        cursor = entries[-1][0] if has_more else latest
+        
+        instances = [entry for _, entry in entries if isinstance(entry, Password)]
+        if fields:
+            decrypted_fields = [field for field in fields if field in Password.ENCRYPTED_FIELDS]
+            changed = PasswordRowSerializer(fields).many(instances, Password.decrypt_many(instances, decrypted_fields))
+        else:
+            changed = self._changed_rows(instances)
+        deleted = [entry for _, entry in entries if not isinstance(entry, Password)]
+        return Response({'cursor': cursor, 'next': cursor if has_more else None, 'changed': changed, 'deleted': deleted})
+    
+    def _changed_rows(self, instances):
+        changed = []
+        for instance, values in zip(instances, Password.decrypt_many(instances)):
+            changed.append({
+                'id': instance.id,
+                **values,
+                'created_at': _datetime(instance.created_at),
+                'updated_at': _datetime(instance.updated_at),
+                'version': instance.version,
+                'breached': instance.breached,
+            })
+        return changed
+    
+    def _fuzzy_list(self, request, search_param):
+        limit = self.paginator.get_page_size(request) or 20
+        index, matches = fuzzy_search(request.user, search_param, limit)
+        
+        fields = self.requested_fields()
+        entries = self.sparse(self.get_queryset(), fields).in_bulk([index.ids[position] for position, _ in matches])
+        found = [(entries[index.ids[position]], position, score) for position, score in matches if index.ids[position] in entries]
+        for obj, position, _ in found:
+            obj.application_name = index.names[position]
+        
+        if fields:
+            # The index already holds the plaintext names.
+            instances = [obj for obj, _, _ in found]
+            decrypted_fields = [field for field in fields if field in Password.ENCRYPTED_FIELDS and field != 'application_name']
+            rows = PasswordRowSerializer(fields).many(instances, Password.decrypt_many(instances, decrypted_fields))
+        else:
+            rows = [self.get_serializer(obj).data for obj, _, _ in found]
+        return Response({'results': [{**row, 'score': round(score, 1)} for row, (_, _, score) in zip(rows, found)]})
     
     def get_queryset(self):
         queryset = Password.objects.filter(owner=self.request.user)
+        if self.action == 'retrieve':
+            queryset = self.sparse(queryset, self.requested_fields())
+        return queryset
+    
+    def sparse(self, queryset, fields):
+        """Only load the columns a ?fields= response reads; every other attribute would cost a query per row."""
+        if fields:
+            queryset = queryset.only('version', 'revision', *PasswordRowSerializer.columns(fields))
+        return queryset
+    
+    def requested_fields(self):
+        """The ?fields= sparse fieldset, or None for the full representation."""
+        fields = [field.strip() for field in self.request.query_params.get('fields', '').split(',') if field.strip()]
+        unknown = set(fields) - set(PasswordRowSerializer.FIELDS)
+        if unknown:
+            raise ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+        return fields or None
+    
+    @action(methods=['GET'], detail=False)
+    def health(self, request):
+        # Entries age without any write, so the date is part of the tag.
+        etag = quote_etag(keyed_digest(request.user.id, refresh_vault_revision(request.user), 'health', timezone.localdate()))
+        if etag_matches(request, etag):
+            return HttpResponseNotModified(headers={'ETag': etag})
         
-        for obj in queryset:
-            fernet_key = obj.decryption_key
-            if fernet_key:
-                fernet = Fernet(fernet_key)
-                decrypted_application_name = fernet.decrypt(obj.application_name.encode()).decode()
-                obj.application_name = decrypted_application_name
+        read_your_writes(request.user)
+        response = Response(health_report(self.get_queryset()), status=status.HTTP_200_OK)
+        response['ETag'] = etag
+        return response
+    
+    @action(methods=['GET'], detail=False)
+    def autofill(self, request):
+        url = request.query_params.get('url')
+        digest = domain_digest(request.user.id, url)
+        if not digest:
+            return Response({'error': 'A valid url is required.'}, status=status.HTTP_400_BAD_REQUEST)
         
-        return queryset
+        host = host_of(url)
+        matches = []
+        instances = list(self.get_queryset().filter(site_domain_digest=digest))
+        for instance, values in zip(instances, Password.decrypt_many(instances)):
+            entry = {'id': instance.id, **values}
+            entry['exact_match'] = host_of(entry.get('site_url')) == host
+            matches.append(entry)
+        matches.sort(key=lambda entry: not entry['exact_match'])
+        return Response(matches, status=status.HTTP_200_OK)
+    
+    @action(methods=['POST'], detail=False, url_path='import')
+    def bulk_import(self, request):
+        if 'archive' in request.data:
+            try:
+                entries = read_archive(request.data['archive'], request.data.get('passphrase', ''))
+            except ArchiveError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        else:
+            entries = request.data.get('entries', [])
+        
+        serializer = self.get_serializer(data=entries, many=True)
+        serializer.is_valid(raise_exception=True)
+        imported = self._bulk_create(serializer.validated_data)
+        return Response({'imported': imported}, status=status.HTTP_201_CREATED)
+    
+    @action(methods=['POST'], detail=False)
+    def export(self, request):
+        passphrase = request.data.get('passphrase')
+        if not passphrase:
+            return Response({'error': 'A passphrase is required to encrypt the export.'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Each server needs its own kind of iterator to stream without buffering.
+        if isinstance(request._request, ASGIRequest):
+            archive = aexport_archive(request.user, passphrase)
+        else:
+            archive = export_archive(request.user, passphrase)
+        response = StreamingHttpResponse(archive, content_type='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename="vault-export.jsonl"'
+        return response
+    
+    def _bulk_create(self, entries):
+        owner = self.request.user
+        with transaction.atomic():
+            first_revision = CustomUser.objects.next_vault_revision(owner.id, count=len(entries)) - len(entries) + 1
+            for start in range(0, len(entries), self.import_batch_size):
+                batch = [{**values, 'password': values.get('password', '')} for values in entries[start:start + self.import_batch_size]]
+                passwords = [Password(owner=owner, revision=first_revision + start + i) for i in range(len(batch))]
+                Password.set_encrypted_many(passwords, batch)
+                search_tokens = []
+                for instance, values in zip(passwords, batch):
+                    search_tokens.extend(build_search_tokens(instance, values))
+                Password.objects.bulk_create(passwords)
+                PasswordSearchToken.objects.bulk_create(search_tokens)
+        return len(entries)
     
 
 class PasswordResetView(APIView):
     serializer_class = PasswordResetSerializer
     permission_classes = [APIKeyPermission]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'send-code'
     
     def post(self, request):
         email = request.data.get('email')
@@ -338,33 +531,7 @@ class PasswordResetView(APIView):
         except CustomUser.DoesNotExist:
             return Response({"error": "A user with this email does not exist."}, status=status.HTTP_404_NOT_FOUND)
 
-        verification_code = ''.join(random.choices(string.digits, k=6))
-        
-        PasswordResetCode.objects.create(user=user, code=verification_code)
-
-        subject = "Password Reset Code"
-        sender_name = 'The Two Devs Team'
-        sender_email = settings.EMAIL_HOST_USER
-        recipient_email = user.email
-
-        html_message = render_to_string('reset_code_email.html', {
-            'verification_code': verification_code,
-            'sender_name': sender_name,
-        })
-
-        plain_message = strip_tags(html_message)
-
-        try:
-            send_mail(
-                subject,
-                plain_message,
-                f"{sender_name} <{sender_email}>",
-                [recipient_email],
-                html_message=html_message,
-                fail_silently=False,
-            )
-        except Exception as e:
-            print(f"Error sending email: {e}")
+        send_reset_code(request=request, user=user)
 
         return Response({"message": "A reset code has been sent to your email."}, status=status.HTTP_200_OK)
     
@@ -372,6 +539,8 @@ class PasswordResetView(APIView):
 class PasswordConfirmView(APIView):
     serializer_class = PasswordConfirmSerializer
     permission_classes = [APIKeyPermission]
+    throttle_classes = [TokenBucketThrottle]
+    throttle_scope = 'confirm-code'
     
     def post(self, request):
         serializer = self.serializer_class(data=request.data)
@@ -387,15 +556,11 @@ class PasswordConfirmView(APIView):
             return Response({"error": "A user with this email does not exist."}, status=status.HTTP_404_NOT_FOUND)
 
         # Validate verification code
-        try:
-            reset_code = PasswordResetCode.objects.get(user__email=email, code=verification_code)
-        except PasswordResetCode.DoesNotExist:
+        if not get_code_store().verify(RESET, user, verification_code):
             return Response({"error": "Invalid verification code."}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = reset_code.user
         user.set_password(new_password)
         user.save()
-        reset_code.delete()
 
         return Response({"message": "Password reset successful."}, status=status.HTTP_200_OK)
     
@@ -407,4 +572,15 @@ class QuickTipViewset(APIView):
         queryset = QuickTip.objects.all()
         return Response(data=queryset.values(), status=200)
     
-    # Task: Schedule quick tips and show each for three days.
\ No newline at end of file
+    # Task: Schedule quick tips and show each for three days.
+    
+    
+class MetricsView(APIView):
+    permission_classes = [APIKeyPermission]
+    
+    def get(self, request):
+        data = {'routes': metrics.registry.snapshot()}
+        if settings.DATABASE_POOL:
+            from Manager.db_pool.base import pool_stats
+            data['connection_pools'] = pool_stats()
+        return Response(data, status=status.HTTP_200_OK)
@@ -0,0 +1,99 @@
+"""
+PostgreSQL backend that hands out connections from a psycopg_pool.ConnectionPool.
+
+Experimental: it is only used when DATABASE_POOL=True, and its tests in
+App/tests.py are skipped unless the test database runs on this backend.
+
+Enable it with ENGINE = 'Manager.db_pool' and an OPTIONS['pool'] dict of
+ConnectionPool arguments (min_size, max_size, timeout, max_idle, ...).
+Connections are checked with ConnectionPool.check_connection before being
+handed out unless OPTIONS['pool']['check'] is False.
+"""
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+from django.db.backends.postgresql import base, creation
+from psycopg import IsolationLevel
+from psycopg_pool import ConnectionPool
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def pool_stats():
+    """Return psycopg_pool statistics for every pool opened in this process."""
+    return {pool.name: {**pool.get_stats(), 'open': not pool.closed} for pool in _pools.values()}
+
+
+def close_pools(name):
+    """Close the pools of every alias connected to database name."""
+    with _pools_lock:
+        pools = [_pools.pop(key) for key in list(_pools) if key[1] == name]
+    for pool in pools:
+        pool.close()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the test database from being
+        # dropped, including those of test mirrors such as read replicas.
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def __init__(self, settings_dict, alias=DEFAULT_DB_ALIAS):
+        super().__init__(settings_dict, alias)
+        if self.settings_dict.get('CONN_MAX_AGE'):
+            raise ImproperlyConfigured('Pooled connections cannot be combined with persistent connections (CONN_MAX_AGE).')
+
+    @property
+    def pool(self):
+        key = (self.alias, self.settings_dict['NAME'])
+        pool = _pools.get(key)
+        if pool is not None:
+            return pool
+        
+        with _pools_lock:
+            if key not in _pools:
+                options = dict(self.settings_dict['OPTIONS'].get('pool', {}))
+                check = options.pop('check', True)
+                _pools[key] = ConnectionPool(
+                    kwargs=self.get_connection_params(),
+                    check=ConnectionPool.check_connection if check else None,
+                    name=f"{self.alias}:{self.settings_dict['NAME']}",
+                    open=False,
+                    **options,
+                )
+            return _pools[key]
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        isolation_level = self.settings_dict['OPTIONS'].get('isolation_level')
+        try:
+            self.isolation_level = IsolationLevel(isolation_level) if isolation_level is not None else IsolationLevel.READ_COMMITTED
+        except ValueError:
+            raise ImproperlyConfigured(
+                f"Invalid transaction isolation level {isolation_level} "
+                f"specified. Use one of the psycopg.IsolationLevel values."
+            )
+        
+        pool = self.pool
+        if pool.closed:
+            pool.open()
+        connection = pool.getconn()
+        connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
+                self.connection = None
@@ -1,7 +1,10 @@
 import os
+import base64
+import hashlib
 import environ
 import dj_database_url
 from pathlib import Path
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -9,12 +12,44 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 SECRET_KEY = os.environ['SECRET_KEY']
 
+DATA_KEY_CACHE_TTL = int(os.getenv('DATA_KEY_CACHE_TTL', 300))
+DATA_KEY_CACHE_SIZE = int(os.getenv('DATA_KEY_CACHE_SIZE', 1024))
+# Seconds between checks of the shared stamp that key rotations bump to drop cached data keys.
+DATA_KEY_GENERATION_CHECK_INTERVAL = float(os.getenv('DATA_KEY_GENERATION_CHECK_INTERVAL', 1))
+
+KEY_ROTATION_BATCH_SIZE = int(os.getenv('KEY_ROTATION_BATCH_SIZE', 1000))
+KEY_ROTATION_MAX_ROWS_PER_SECOND = int(os.getenv('KEY_ROTATION_MAX_ROWS_PER_SECOND', 0))
+
+CRYPTO_POOL_WORKERS = int(os.getenv('CRYPTO_POOL_WORKERS', min(4, os.cpu_count() or 1)))
+CRYPTO_PARALLEL_THRESHOLD = int(os.getenv('CRYPTO_PARALLEL_THRESHOLD', 256))
+
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', os.cpu_count() or 1))
+LOGIN_HASH_QUEUE_DEPTH = int(os.getenv('LOGIN_HASH_QUEUE_DEPTH', 2 * LOGIN_HASH_WORKERS))
+LOGIN_RETRY_AFTER = int(os.getenv('LOGIN_RETRY_AFTER', 1))
+LOGIN_CREATE_SESSION = os.getenv('LOGIN_CREATE_SESSION', 'True') == 'True'
+
 ENVIRONMENT = os.environ['ENVIRONMENT']
 
 if ENVIRONMENT == 'development':
     DEBUG = True
 else:
     DEBUG = False
+
+BLIND_INDEX_KEY = os.getenv('BLIND_INDEX_KEY')
+
+# Comma separated Fernet keys that wrap each user's data key. The first key wraps
+# new data keys; the rest are only used to unwrap while a master key is rotated.
+VAULT_MASTER_KEYS = os.getenv('VAULT_MASTER_KEYS')
+
+# Both keys must survive a SECRET_KEY rotation, so they are only derived from
+# it in development.
+if DEBUG:
+    BLIND_INDEX_KEY = BLIND_INDEX_KEY or SECRET_KEY
+    VAULT_MASTER_KEYS = VAULT_MASTER_KEYS or base64.urlsafe_b64encode(hashlib.sha256(SECRET_KEY.encode()).digest()).decode()
+elif not BLIND_INDEX_KEY or not VAULT_MASTER_KEYS:
+    raise ImproperlyConfigured('BLIND_INDEX_KEY and VAULT_MASTER_KEYS must be set outside development.')
+
+VAULT_MASTER_KEYS = VAULT_MASTER_KEYS.split(',')
     
 
 env = environ.Env()
@@ -22,9 +57,55 @@ env = environ.Env()
 environ.Env.read_env()
 
 DATABASES = {
-    'default': dj_database_url.parse(env('DATABASE_URL'))
+    'default': dj_database_url.parse(
+        env('DATABASE_URL'),
+        conn_max_age=int(os.getenv('CONN_MAX_AGE', 0)),
+        conn_health_checks=True,
+    )
 }
 
+# Read replicas, as a comma-separated list of database URLs. Safe reads go to
+# them through App.routers.ReplicaRouter; see that module for the rules.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+REPLICA_RETRY_AFTER = int(os.getenv('REPLICA_RETRY_AFTER', 30))
+
+for number, url in enumerate(DATABASE_REPLICA_URLS):
+    DATABASES[f'replica_{number}'] = dj_database_url.parse(
+        url,
+        conn_max_age=int(os.getenv('CONN_MAX_AGE', 0)),
+        conn_health_checks=True,
+    )
+    DATABASES[f'replica_{number}']['TEST'] = {'MIRROR': 'default'}
+
+if DATABASE_REPLICA_URLS:
+    DATABASE_ROUTERS = ['App.routers.ReplicaRouter']
+
+# Experimental: hand out Postgres connections from a psycopg pool instead of
+# connecting per request. See Manager/db_pool/base.py.
+DATABASE_POOL = os.getenv('DATABASE_POOL', 'False') == 'True'
+
+for database in DATABASES.values():
+    if DATABASE_POOL and database['ENGINE'] == 'django.db.backends.postgresql':
+        database['ENGINE'] = 'Manager.db_pool'
+        database['CONN_MAX_AGE'] = 0
+        database.setdefault('OPTIONS', {})['pool'] = {
+            'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+            'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+            'timeout': float(os.getenv('DATABASE_POOL_TIMEOUT', 10)),
+            'max_idle': float(os.getenv('DATABASE_POOL_MAX_IDLE', 600)),
+            'check': os.getenv('DATABASE_POOL_CHECK', 'True') == 'True',
+        }
+
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+
     
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '').split(',')
 
@@ -61,6 +142,15 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Opt-in per-request query, crypto and email timings (Server-Timing header + /api/v1/metrics/).
+INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED', 'False') == 'True'
+
+if INSTRUMENTATION_ENABLED:
+    MIDDLEWARE.insert(0, 'App.middleware.InstrumentationMiddleware')
+
+if DATABASE_REPLICA_URLS:
+    MIDDLEWARE.insert(0, 'App.middleware.ReplicaPinningMiddleware')
+
 ROOT_URLCONF = 'Manager.urls'
 
 TEMPLATES = [
@@ -81,6 +171,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'Manager.wsgi.application'
 
+ASGI_APPLICATION = 'Manager.asgi.application'
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -95,8 +187,20 @@ AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
     },
+    {
+        'NAME': 'App.breach.BreachedPasswordValidator',
+    },
 ]
 
+# Offline breached-password filter built with manage.py build_breach_filter;
+# breach checks are skipped when it is unset.
+BREACH_FILTER_PATH = os.getenv('BREACH_FILTER_PATH')
+
+# Vault health report: entries scoring at or below HEALTH_WEAK_STRENGTH (0-4)
+# are weak, and passwords unchanged for HEALTH_PASSWORD_MAX_AGE_DAYS are old.
+HEALTH_WEAK_STRENGTH = int(os.getenv('HEALTH_WEAK_STRENGTH', 1))
+HEALTH_PASSWORD_MAX_AGE_DAYS = int(os.getenv('HEALTH_PASSWORD_MAX_AGE_DAYS', 365))
+
 
 LANGUAGE_CODE = 'en-us'
 
@@ -118,18 +222,93 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'App.CustomUser'
 
 
+# Validated API keys are kept in an in-process LRU for API_KEY_CACHE_TTL seconds,
+# and in the shared cache named by API_KEY_CACHE_ALIAS when it is set.
+API_KEY_CACHE_TTL = int(os.getenv('API_KEY_CACHE_TTL', 30))
+API_KEY_CACHE_SIZE = int(os.getenv('API_KEY_CACHE_SIZE', 1024))
+API_KEY_CACHE_ALIAS = os.getenv('API_KEY_CACHE_ALIAS')
+# Seconds between checks of the stamp in the default cache that changing any
+# API key bumps, dropping the keys every process has cached.
+API_KEY_GENERATION_CHECK_INTERVAL = float(os.getenv('API_KEY_GENERATION_CHECK_INTERVAL', 1))
+
+# JWT users are kept in process for AUTH_USER_CACHE_TTL seconds, checked
+# against a per-user version stamp in the default cache. Only used when that
+# cache is shared (Redis), since a per-process stamp would miss other workers.
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', 60))
+AUTH_USER_CACHE_SIZE = int(os.getenv('AUTH_USER_CACHE_SIZE', 10000))
+
+QUICK_TIPS_CACHE_TTL = int(os.getenv('QUICK_TIPS_CACHE_TTL', 300))
+
+# In-memory vault indexes used by ?search=...&fuzzy=true
+FUZZY_INDEX_TTL = int(os.getenv('FUZZY_INDEX_TTL', 600))
+FUZZY_INDEX_CACHE_SIZE = int(os.getenv('FUZZY_INDEX_CACHE_SIZE', 256))
+FUZZY_SCORE_CUTOFF = int(os.getenv('FUZZY_SCORE_CUTOFF', 60))
+
+# Verification and reset codes. The cache store needs a cache shared by all
+# workers, so it is only the default when Redis is configured.
+CODE_STORE = os.getenv('CODE_STORE', 'App.codes.CacheCodeStore' if REDIS_URL else 'App.codes.DatabaseCodeStore')
+CODE_STORE_CACHE_ALIAS = os.getenv('CODE_STORE_CACHE_ALIAS', 'default')
+CODE_TTL = int(os.getenv('CODE_TTL', 300))
+CODE_MAX_ATTEMPTS = int(os.getenv('CODE_MAX_ATTEMPTS', 5))
+CODE_PURGE_BATCH_SIZE = int(os.getenv('CODE_PURGE_BATCH_SIZE', 1000))
+
+# Deleted entries are reported to syncing clients for this many days; a client
+# whose cursor is older has to sync again from scratch.
+TOMBSTONE_RETENTION_DAYS = int(os.getenv('TOMBSTONE_RETENTION_DAYS', 90))
+
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'App.authentication.CachedJWTAuthentication',
     ],
+    # Used by App.throttling.TokenBucketThrottle; '<scope>-account' and
+    # '<scope>-ip' override '<scope>' for that bucket.
+    'DEFAULT_THROTTLE_RATES': {
+        'login-account': '10/min',
+        'login-ip': '60/min',
+        'send-code-account': '5/hour',
+        'send-code-ip': '30/hour',
+        'confirm-code-account': '10/hour',
+        'confirm-code-ip': '60/hour',
+    },
+}
+
+# Alias of a shared cache (e.g. 'default' with Redis) to count throttled
+# requests across processes; in-process buckets are used when unset.
+THROTTLE_CACHE_ALIAS = os.getenv('THROTTLE_CACHE_ALIAS')
+THROTTLE_BUCKETS_SIZE = int(os.getenv('THROTTLE_BUCKETS_SIZE', 100000))
+
+
+# Celery configuration. Tasks only leave the web process once a broker is
+# set explicitly, and then the Procfile's worker and beat processes must run
+# (one beat only); without one, tasks run eagerly in the request.
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL')
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', str(not CELERY_BROKER_URL)) == 'True'
+CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers:DatabaseScheduler'
+CELERY_BEAT_SCHEDULE = {
+    'send-queued-emails': {
+        'task': 'App.tasks.send_queued_emails',
+        'schedule': 60.0,
+    },
+    'purge-expired-codes': {
+        'task': 'App.tasks.purge_expired_codes',
+        'schedule': 300.0,
+    },
 }
 
 
 # Email configuration
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', BASE_DIR / 'sent_emails')
 EMAIL_HOST = os.environ['EMAIL_HOST']
 EMAIL_PORT = 587 
 EMAIL_USE_TLS = True
 EMAIL_USE_SSL = False
 EMAIL_HOST_USER = os.environ['EMAIL_HOST_USER']
-EMAIL_HOST_PASSWORD = os.environ['EMAIL_HOST_PASSWORD']
\ No newline at end of file
+EMAIL_HOST_PASSWORD = os.environ['EMAIL_HOST_PASSWORD']
+
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 50))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_RETRY_BACKOFF = int(os.getenv('EMAIL_OUTBOX_RETRY_BACKOFF', 30))
+# Seconds before an email claimed by a worker that never reported back is retried.
+EMAIL_OUTBOX_CLAIM_TIMEOUT = int(os.getenv('EMAIL_OUTBOX_CLAIM_TIMEOUT', 600))